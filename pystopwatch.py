@@ -15,23 +15,155 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 import os
-import re
 import subprocess
 import sys
-from string import capwords
 from time import localtime
+from time import monotonic_ns
 from time import time
 
+VERSION = "2019.1"
+MODE_NAMES = ("time", "stopwatch", "countdown-a", "countdown-b")
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line. This runs before the GUI toolkit is imported so
+    that invocations such as --help and --version return immediately.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="pystopwatch",
+        description="A stopwatch with a clock and two countdown timers "
+        "that can minimize to the tray.",
+    )
+    parser.add_argument("--version",
+                        action="version",
+                        version="%(prog)s " + VERSION)
+    parser.add_argument(
+        "--mode",
+        choices=MODE_NAMES,
+        help="the mode to start in",
+    )
+    parser.add_argument(
+        "--start-in-tray",
+        action="store_true",
+        help="start minimized in the tray",
+    )
+    parser.add_argument(
+        "--font",
+        metavar="FONT",
+        help='the font for the display, e.g. "DejaVu Sans Ultra-Light 36"',
+    )
+    parser.add_argument(
+        "--import",
+        dest="import_files",
+        action="append",
+        metavar="FILE",
+        help="load timers from a CSV or iCalendar file, reloading it when it "
+        "changes; may be given more than once",
+    )
+    parser.add_argument(
+        "--emit",
+        choices=("jsonl", "csv"),
+        help="write a record for every start, stop, reset, lap, alarm and "
+        "mode change to standard output (or --emit-fd)",
+    )
+    parser.add_argument(
+        "--emit-fd",
+        type=int,
+        default=1,
+        metavar="FD",
+        help="the file descriptor for --emit (default: 1)",
+    )
+    parser.add_argument(
+        "--emit-ticks",
+        action="store_true",
+        help="also emit a record every second; these are dropped when the "
+        "reader falls behind",
+    )
+    # Only one trigger can own the stopwatch.
+    triggers = parser.add_mutually_exclusive_group()
+    triggers.add_argument(
+        "--time",
+        action="store_true",
+        help="run COMMAND and time it with the stopwatch, which starts when "
+        "the command is launched and stops the instant it exits",
+    )
+    triggers.add_argument(
+        "--stop-on-exit",
+        type=int,
+        metavar="PID",
+        help="start the stopwatch and stop it when process PID exits",
+    )
+    triggers.add_argument(
+        "--stop-on-file",
+        metavar="PATH",
+        help="start the stopwatch and stop it when PATH appears",
+    )
+    parser.add_argument(
+        "command",
+        nargs="*",
+        help="the command for --time, usually given after --",
+    )
+    parser.add_argument(
+        "--status",
+        nargs="?",
+        const="",
+        metavar="FORMAT",
+        help="print the current timer of the running instance and exit; "
+        "FORMAT may use the fields {label}, {time}, {running} and {state}",
+    )
+    args = parser.parse_args(argv)
+    if args.time and not args.command:
+        parser.error("--time requires a command")
+    if args.command and not args.time:
+        parser.error("unexpected arguments: " + " ".join(args.command))
+    if args.emit is not None:
+        try:
+            os.fstat(args.emit_fd)
+        except OSError as e:
+            parser.error("invalid --emit-fd %d: %s" %
+                         (args.emit_fd, e.strerror))
+    return args
+
+
+if __name__ == "__main__":
+    ARGS = parse_args()
+    if ARGS.status is not None:
+        from pystopwatch_shm import main as print_status
+
+        sys.exit(print_status(ARGS.status or None))
+
+# The GUI toolkit is only imported once the command line has been handled.
+# pylint: disable=wrong-import-position
 import gi
+
+gi.require_version("Gtk", "3.0")
+gi.require_version("Gdk", "3.0")
+gi.require_version("GdkPixbuf", "2.0")
+gi.require_version("Pango", "1.0")
 from gi.repository import Gdk
 from gi.repository import GdkPixbuf
 from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Pango
 
-gi.require_version("Gtk", "3.0")
-# from gtk import EXPAND,FILL,STOCK_GO_UP,STOCK_GO_DOWN
-# import gobject
+from pystopwatch_import import parse_deadline
+from pystopwatch_import import read_timers
+from pystopwatch_timers import apply_catchup_policy
+from pystopwatch_timers import CATCHUP_POLICIES
+from pystopwatch_timers import collect_due
+from pystopwatch_timers import compile_alarm_text
+from pystopwatch_timers import IntervalSequence
+from pystopwatch_timers import latest_mode
+from pystopwatch_timers import Scheduler
+from pystopwatch_timers import StallDetector
+from pystopwatch_timers import Timer
+from pystopwatch_timers import TimeTree
+from pystopwatch_timers import Trigger
+
+# pylint: enable=wrong-import-position
 
 
 def get_conf_dir(name):
@@ -208,12 +340,282 @@ class TimeFieldAdjuster(Gtk.Frame):
                 self.callback(self.value)
 
 
+class TimerBoard(Gtk.Window):
+    """
+    A window listing the named timers. The rows only hold references to the
+    timers; the cells are computed when drawn, so rows outside the viewport
+    cost nothing, and update() only touches visible rows whose second changed.
+    """
+
+    def __init__(self, scheduler, title="Timers"):
+        GObject.GObject.__init__(self, type=Gtk.WindowType.TOPLEVEL)
+        self.scheduler = scheduler
+        self.now = time()
+        self.set_title(title)
+        self.set_default_size(400, 500)
+        self.set_border_width(5)
+
+        self.store = Gtk.ListStore(GObject.TYPE_PYOBJECT)
+        self.view = Gtk.TreeView(model=self.store)
+        self.view.set_fixed_height_mode(True)
+        for heading, func in (("name", self.render_name),
+                              ("remaining", self.render_remaining),
+                              ("state", self.render_state)):
+            renderer = Gtk.CellRendererText()
+            column = Gtk.TreeViewColumn(heading, renderer)
+            column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            column.set_fixed_width(200 if heading == "name" else 100)
+            column.set_cell_data_func(renderer, func)
+            self.view.append_column(column)
+
+        scroller = Gtk.ScrolledWindow()
+        scroller.set_policy(Gtk.PolicyType.AUTOMATIC,
+                            Gtk.PolicyType.AUTOMATIC)
+        scroller.add(self.view)
+
+        self.name_entry = Gtk.Entry()
+        self.name_entry.set_placeholder_text("name")
+        self.time_entry = Gtk.Entry()
+        self.time_entry.set_placeholder_text("[[H:]M:]S or @H:M")
+        self.time_entry.connect("activate", self.add_timer)
+        add_button = Gtk.Button(label="Add")
+        add_button.connect("clicked", self.add_timer)
+        remove_button = Gtk.Button(label="Remove")
+        remove_button.connect("clicked", self.remove_timer)
+
+        entry_box = Gtk.HBox()
+        entry_box.pack_start(self.name_entry, True, True, 0)
+        entry_box.pack_start(self.time_entry, True, True, 0)
+        entry_box.pack_start(add_button, False, False, 0)
+        entry_box.pack_start(remove_button, False, False, 0)
+
+        vbox = Gtk.VBox()
+        vbox.pack_start(scroller, True, True, 0)
+        vbox.pack_start(entry_box, False, False, 5)
+        self.add(vbox)
+        vbox.show_all()
+
+        self.connect("delete_event", lambda *args: self.hide() or True)
+        self.reload()
+
+    def reload(self):
+        """Rebuild the model from the scheduler, detached from the view."""
+        self.view.set_model(None)
+        self.store.clear()
+        for timer in self.scheduler.timers:
+            self.store.append((timer, ))
+        self.view.set_model(self.store)
+
+    def append(self, timer):
+        self.store.append((timer, ))
+
+    def update(self, now):
+        self.now = now
+        if not self.get_visible():
+            return
+        visible = self.view.get_visible_range()
+        if not visible:
+            return
+        start, end = visible[0].get_indices()[0], visible[1].get_indices()[0]
+        for i in range(start, end + 1):
+            path = Gtk.TreePath.new_from_indices([i])
+            it = self.store.get_iter(path)
+            timer = self.store.get_value(it, 0)
+            shown = int(timer.remaining(now))
+            if shown != timer.shown:
+                timer.shown = shown
+                self.store.row_changed(path, it)
+
+    def render_name(self, column, cell, model, it, data=None):
+        cell.set_property("text", model.get_value(it, 0).name)
+
+    def render_remaining(self, column, cell, model, it, data=None):
+        timer = model.get_value(it, 0)
+        timer.shown = int(timer.remaining(self.now))
+        cell.set_property("text", format_seconds(timer.shown))
+
+    def render_state(self, column, cell, model, it, data=None):
+        timer = model.get_value(it, 0)
+        cell.set_property("text", "expired" if timer.expired else "running")
+
+    def add_timer(self, *args):
+        name = self.name_entry.get_text().strip()
+        try:
+            end = parse_deadline(self.time_entry.get_text())
+        except ValueError:
+            return
+        timer = Timer(name or self.time_entry.get_text().strip(), end)
+        self.scheduler.add(timer)
+        self.append(timer)
+        self.name_entry.set_text("")
+        self.time_entry.set_text("")
+
+    def remove_timer(self, *args):
+        model, it = self.view.get_selection().get_selected()
+        if it is not None:
+            self.scheduler.remove(model.get_value(it, 0))
+            model.remove(it)
+
+
+class GroupView(Gtk.Window):
+    """
+    A window showing a TimeTree with the live total of every group. Only
+    the rows of running nodes and their ancestors are refreshed on a tick.
+    """
+
+    def __init__(self, tree, title="Groups", track=None, changed=None):
+        GObject.GObject.__init__(self, type=Gtk.WindowType.TOPLEVEL)
+        self.tree = tree
+        self.track = track
+        self.changed = changed
+        self.now = time()
+        self.set_title(title)
+        self.set_default_size(400, 500)
+        self.set_border_width(5)
+
+        self.store = Gtk.TreeStore(GObject.TYPE_PYOBJECT)
+        self.view = Gtk.TreeView(model=self.store)
+        self.view.set_fixed_height_mode(True)
+        for heading, func in (("name", self.render_name),
+                              ("elapsed", self.render_elapsed)):
+            renderer = Gtk.CellRendererText()
+            column = Gtk.TreeViewColumn(heading, renderer)
+            column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            column.set_fixed_width(250 if heading == "name" else 100)
+            column.set_cell_data_func(renderer, func)
+            self.view.append_column(column)
+        self.view.connect("row-activated", self.toggle_node)
+
+        scroller = Gtk.ScrolledWindow()
+        scroller.set_policy(Gtk.PolicyType.AUTOMATIC,
+                            Gtk.PolicyType.AUTOMATIC)
+        scroller.add(self.view)
+
+        self.path_entry = Gtk.Entry()
+        self.path_entry.set_placeholder_text("client/project/task")
+        self.path_entry.connect("activate", self.add_node)
+        add_button = Gtk.Button(label="Add")
+        add_button.connect("clicked", self.add_node)
+        toggle_button = Gtk.Button(label="Start/Stop")
+        toggle_button.connect("clicked", self.toggle_node)
+        track_button = Gtk.Button(label="Stopwatch")
+        track_button.set_tooltip_text(
+            "track the selected entry with the stopwatch")
+        track_button.connect("clicked", self.track_node)
+
+        entry_box = Gtk.HBox()
+        entry_box.pack_start(self.path_entry, True, True, 0)
+        entry_box.pack_start(add_button, False, False, 0)
+        entry_box.pack_start(toggle_button, False, False, 0)
+        entry_box.pack_start(track_button, False, False, 0)
+
+        vbox = Gtk.VBox()
+        vbox.pack_start(scroller, True, True, 0)
+        vbox.pack_start(entry_box, False, False, 5)
+        self.add(vbox)
+        vbox.show_all()
+
+        self.connect("delete_event", lambda *args: self.hide() or True)
+        self.reload()
+
+    def reload(self):
+        self.view.set_model(None)
+        self.store.clear()
+        for node in self.tree.walk():
+            node.iter = self.store.append(node.parent.iter, (node, ))
+        self.view.set_model(self.store)
+
+    def update(self, now):
+        self.now = now
+        if not self.get_visible():
+            return
+        seen = set()
+        for leaf in self.tree.running:
+            for node in leaf.ancestry():
+                if node in seen or node.iter is None:
+                    break
+                seen.add(node)
+                shown = int(node.elapsed(now))
+                if shown != node.shown:
+                    node.shown = shown
+                    self.store.row_changed(self.store.get_path(node.iter),
+                                           node.iter)
+
+    def refresh(self, node):
+        """Redraw a node and its ancestors after it was started or stopped."""
+        for parent in node.ancestry():
+            if parent.iter is not None:
+                self.store.row_changed(self.store.get_path(parent.iter),
+                                       parent.iter)
+
+    def render_name(self, column, cell, model, it, data=None):
+        node = model.get_value(it, 0)
+        cell.set_property("text", node.name)
+        cell.set_property("weight", 700 if node.start_time is not None else
+                          400)
+
+    def render_elapsed(self, column, cell, model, it, data=None):
+        node = model.get_value(it, 0)
+        node.shown = int(node.elapsed(self.now))
+        cell.set_property("text", format_seconds(node.shown))
+
+    def get_selected(self):
+        model, it = self.view.get_selection().get_selected()
+        if it is None:
+            return None
+        return model.get_value(it, 0)
+
+    def add_node(self, *args):
+        node, created = self.tree.get(self.path_entry.get_text(), create=True)
+        for new in created:
+            new.iter = self.store.append(new.parent.iter, (new, ))
+        if node.iter is not None:
+            self.view.expand_to_path(self.store.get_path(node.iter))
+            self.view.get_selection().select_iter(node.iter)
+        self.path_entry.set_text("")
+        if created and self.changed is not None:
+            self.changed()
+
+    def toggle_node(self, *args):
+        node = self.get_selected()
+        if node is None:
+            return
+        if node.start_time is None:
+            self.tree.start(node)
+        else:
+            self.tree.stop(node)
+        self.refresh(node)
+        if self.changed is not None:
+            self.changed()
+
+    def track_node(self, *args):
+        if self.track is not None:
+            self.track(self.get_selected())
+
+
+def format_seconds(secs):
+    """Format a (possibly negative) number of seconds as [-]HH:MM:SS."""
+    sign = "-" if secs < 0 else ""
+    (m, s) = divmod(abs(int(secs)), 60)
+    (h, m) = divmod(m, 60)
+    return "%s%02d:%02d:%02d" % (sign, h, m, s)
+
+
+def format_clock(timestamp):
+    """Format a timestamp as the local HH:MM:SS."""
+    time_array = localtime(timestamp)
+    return "%02d:%02d:%02d" % (time_array[3], time_array[4], time_array[5])
+
+
 class Stopwatch:
     MODES = 4
     (TIME_DISPLAY, STOPWATCH, COUNTDOWN_A, COUNTDOWN_B) = list(range(0, MODES))
     MODE_LABEL = [
         "Current Time", "Stopwatch", "Countdown Timer A", "Countdown Timer B"
     ]
+    CATCHUP_POLICIES = CATCHUP_POLICIES
+    # Seconds between ticks beyond which the main loop is considered stalled.
+    STALL_THRESHOLD = 2.0
     ICON_DATA = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
 
 <svg
@@ -267,38 +669,60 @@ class Stopwatch:
         return True
 
     def destroy(self, widget, data=None):
+        if self.dashboard is not None:
+            self.dashboard.stop()
+        if self.plugins is not None:
+            self.plugins.report()
+            self.plugins.stop()
+        if self.state_file is not None:
+            self.state_file.close()
+        if self.events is not None:
+            self.events.close()
+        if self.tracked is not None:
+            # The stopwatch does not survive a restart, so neither may the run
+            # of the group it drives.
+            self.groups.stop(self.tracked)
+        self.save_groups()
         Gtk.main_quit()
 
     def __init__(
         self,
         name="pyStopwatch",
-        display_font=Pango.font_description_from_string(
-            "DejaVu Sans Ultra-Light 36"),
+        display_font=None,
         alarm_cmd="",
         alarm_txt="%t",
         mode=None,
-        start_in_tray=False,
+        start_in_tray=None,
+        import_files=None,
+        emit=None,
+        emit_fd=1,
+        emit_ticks=False,
+        time_command=None,
+        stop_on_exit=None,
+        stop_on_file=None,
     ):
         self.name = name
-        self.display_font = display_font
+        self.display_font = Pango.font_description_from_string(
+            "DejaVu Sans Ultra-Light 36")
         self.alarm_cmd = alarm_cmd
         self.alarm_txt = alarm_txt
+        self.alarm_template = compile_alarm_text(alarm_txt)
 
+        self.mode = self.TIME_DISPLAY
         if mode:
             try:
                 mode = int(mode)
                 if 0 <= mode < self.MODES:
                     self.mode = mode
-            except:
+            except ValueError:
                 pass
-        else:
-            self.mode = self.TIME_DISPLAY
 
-        self.start_in_tray = start_in_tray
+        self.start_in_tray = False
 
         config_dir = get_conf_dir(self.name)
         cache_dir = get_cache_dir(self.name)
         self.conf = os.path.join(config_dir, self.name + ".conf")
+        self.groups_file = os.path.join(config_dir, self.name + ".groups")
         self.icon = os.path.join(cache_dir, "icon.svg")
         if not os.path.exists(self.icon):
             if not os.path.isdir(cache_dir):
@@ -306,6 +730,28 @@ class Stopwatch:
             with open(self.icon, "w") as f:
                 f.write(self.ICON_DATA)
         self.close_to_tray = False
+        self.dashboard_address = ""
+        self.dashboard = None
+        self.sequence_txt = ""
+        self.import_files = []
+        self.imports = {}
+        # Import files that could not be found, so they are reported once.
+        self.missing_imports = set()
+        self.sequence = None
+        self.plugins = None
+        self.state_file = None
+        self.events = None
+        self.scheduler = Scheduler()
+        self.board = None
+        self.groups = TimeTree()
+        self.groups_view = None
+        self.tracked = None
+        # The Trigger that owns the stopwatch run, if any.
+        self.trigger = None
+        self.last_state = None
+        self.stall_detector = StallDetector(self.STALL_THRESHOLD)
+        self.catchup_policy = "all"
+        self.laps = []
         self.is_running = []
         self.hours = []
         self.mins = []
@@ -321,6 +767,34 @@ class Stopwatch:
             self.secs.append(s)
 
         self.load_settings()
+        # Explicit arguments take precedence over the saved settings.
+        if display_font is not None:
+            self.display_font = display_font
+        if start_in_tray is not None:
+            self.start_in_tray = start_in_tray
+        if self.sequence:
+            (self.hours[self.COUNTDOWN_A], self.mins[self.COUNTDOWN_A],
+             self.secs[self.COUNTDOWN_A]) = self.sequence.remaining_hms()
+        if self.dashboard_address:
+            self.start_dashboard()
+        if emit is not None:
+            from pystopwatch_events import EventWriter
+            try:
+                self.events = EventWriter(emit_fd, emit, emit_ticks)
+            except OSError as e:
+                sys.stderr.write("error: unable to emit events to fd %d: %s\n"
+                                 % (emit_fd, e))
+        plugin_dir = os.path.join(config_dir, "plugins")
+        if os.path.isdir(plugin_dir):
+            from pystopwatch_plugins import PluginManager
+            self.plugins = PluginManager()
+            self.plugins.discover(plugin_dir)
+        self.open_state_file()
+        self.groups.load(self.groups_file)
+        self.extra_import_files = list(import_files or [])
+        if self.import_files or self.extra_import_files:
+            self.check_imports()
+            GObject.timeout_add_seconds(2, self.check_imports)
         self.table_options = {"xpadding": 0, "ypadding": 0}
 
         # main window
@@ -420,6 +894,16 @@ class Stopwatch:
 
         self.menu = Gtk.Menu()
 
+        self.board_item = Gtk.MenuItem("Timers")
+        self.menu.append(self.board_item)
+        self.board_item.connect("activate", self.open_board)
+        self.board_item.show()
+
+        self.groups_item = Gtk.MenuItem("Groups")
+        self.menu.append(self.groups_item)
+        self.groups_item.connect("activate", self.open_groups)
+        self.groups_item.show()
+
         self.prefs = Gtk.MenuItem("Preferences")
         self.menu.append(self.prefs)
         self.prefs.connect("activate", self.open_preferences)
@@ -523,6 +1007,13 @@ class Stopwatch:
         self.fontseldiag.set_font_name(self.display_font.to_string())
         self.fontseldiag.set_preview_text("0123456789")
 
+        if time_command:
+            self.time_command(time_command)
+        elif stop_on_exit is not None:
+            self.stop_on_exit(stop_on_exit)
+        elif stop_on_file is not None:
+            self.stop_on_file(stop_on_file)
+
     #    self.fontseldiag.apply_button.connect('clicked',self.set_font)
     #    self.fontseldiag.ok_button.connect('clicked',self.set_font_and_close)
     #    self.fontseldiag.cancel_button.connect('clicked',self.close_font_diag)
@@ -544,12 +1035,52 @@ class Stopwatch:
         if event.button == 3:
             self.statusicon.emit("popup-menu", 0, 0)
 
+    def open_board(self, *args):
+        if self.board is None:
+            self.board = TimerBoard(self.scheduler, self.name + " Timers")
+        self.board.show()
+
+    def open_groups(self, *args):
+        if self.groups_view is None:
+            self.groups_view = GroupView(self.groups,
+                                         self.name + " Groups",
+                                         track=self.track_group,
+                                         changed=self.save_groups)
+        self.groups_view.show()
+
+    def track_group(self, node):
+        """Bind the stopwatch to a group entry, or unbind it with None."""
+        now = time()
+        if self.tracked is not None and self.is_running[self.STOPWATCH]:
+            self.groups.stop(self.tracked, now)
+            self.refresh_group(self.tracked)
+        self.tracked = node
+        if node is not None and self.is_running[self.STOPWATCH]:
+            self.groups.start(node, now)
+            self.refresh_group(node)
+        if self.mode == self.STOPWATCH:
+            self.display_frame.set_label(self.get_mode_label())
+        self.save_groups()
+
+    def refresh_group(self, node):
+        if self.groups_view is not None:
+            self.groups_view.refresh(node)
+
+    def save_groups(self, *args):
+        if not self.groups.root.children:
+            return
+        conf_dir = os.path.dirname(self.groups_file)
+        if not os.path.exists(conf_dir):
+            os.makedirs(conf_dir)
+        self.groups.save(self.groups_file)
+
     def open_preferences(self, *args):
         self.prefs_win.show()
 
     def apply(self, *args):
         self.alarm_cmd = self.prefs_win.cmd.get_text()
         self.alarm_txt = self.prefs_win.txt.get_text()
+        self.alarm_template = compile_alarm_text(self.alarm_txt)
         self.start_in_tray = self.prefs_win.start_in_tray.get_active()
         self.close_to_tray = self.prefs_win.close_to_tray.get_active()
         self.prefs_win.hide()
@@ -579,6 +1110,10 @@ class Stopwatch:
         else:
             val = "0"
         f.write(self.create_tag("close_to_tray", val))
+        f.write(self.create_tag("dashboard_address", self.dashboard_address))
+        f.write(self.create_tag("sequence", self.sequence_txt))
+        f.write(self.create_tag("imports", "\n".join(self.import_files)))
+        f.write(self.create_tag("catchup_policy", self.catchup_policy))
 
         f.close()
 
@@ -611,6 +1146,7 @@ class Stopwatch:
             value = self.parse_tag(text, "alarm_txt")
             if value is not None:
                 self.alarm_txt = value
+                self.alarm_template = compile_alarm_text(value)
 
             value = self.parse_tag(text, "start_in_tray")
             if value is not None:
@@ -620,6 +1156,110 @@ class Stopwatch:
             if value is not None:
                 self.close_to_tray = value == "1"
 
+            value = self.parse_tag(text, "dashboard_address")
+            if value is not None:
+                self.dashboard_address = value.strip()
+
+            value = self.parse_tag(text, "sequence")
+            if value is not None:
+                self.set_sequence(value)
+
+            value = self.parse_tag(text, "catchup_policy")
+            if value is not None:
+                if value.strip() in self.CATCHUP_POLICIES:
+                    self.catchup_policy = value.strip()
+                else:
+                    sys.stderr.write('error: unknown catch-up policy "%s"\n' %
+                                     value)
+
+            value = self.parse_tag(text, "imports")
+            if value is not None:
+                self.import_files = [
+                    os.path.expanduser(x.strip()) for x in value.splitlines()
+                    if x.strip()
+                ]
+
+    def set_sequence(self, text):
+        self.sequence_txt = text
+        try:
+            sequence = IntervalSequence.from_text(text)
+        except ValueError:
+            sys.stderr.write('error: invalid sequence "%s"\n' % text)
+            sequence = None
+        self.sequence = sequence if sequence else None
+
+    def import_timers(self, path, mtime=None):
+        """
+        Load the timers of a CSV or iCalendar file. When the file has been
+        imported before, only the entries that changed are replaced.
+        """
+        old = self.imports.get(path, (None, {}))[1]
+        now = time()
+        try:
+            entries = {entry.key: entry for entry in read_timers(path, now)}
+        except (OSError, ValueError) as e:
+            sys.stderr.write('error: unable to import "%s": %s\n' % (path, e))
+            self.imports[path] = (mtime, old)
+            return
+
+        loaded = {}
+        added = []
+        removed = []
+        for key, (entry, timer) in old.items():
+            new = entries.get(key)
+            if new is not None and new[:2] + new[3:] == entry[:2] + entry[3:]:
+                loaded[key] = (entry, timer)
+            else:
+                removed.append(timer)
+        for key, entry in entries.items():
+            if key not in loaded and entry.end > now:
+                timer = Timer(entry.name, entry.end, entry.alarm_txt,
+                              entry.alarm_cmd, entry.literal)
+                loaded[key] = (entry, timer)
+                added.append(timer)
+
+        self.imports[path] = (mtime, loaded)
+        self.scheduler.remove_many(removed)
+        self.scheduler.add_many(added)
+        if self.board is not None and (added or removed):
+            self.board.reload()
+
+    def check_imports(self):
+        """Import the timer files that are new or have been modified."""
+        for path in self.import_files + self.extra_import_files:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError as e:
+                if path not in self.missing_imports:
+                    self.missing_imports.add(path)
+                    sys.stderr.write('error: unable to import "%s": %s\n' %
+                                     (path, e.strerror))
+                continue
+            self.missing_imports.discard(path)
+            if self.imports.get(path, (None, ))[0] != mtime:
+                self.import_timers(path, mtime)
+        return True
+
+    def open_state_file(self):
+        from pystopwatch_shm import StateWriter, get_state_path
+        try:
+            self.state_file = StateWriter(get_state_path(self.name))
+        except OSError as e:
+            sys.stderr.write("error: unable to create the state file: %s\n" %
+                             e)
+
+    def start_dashboard(self):
+        from pystopwatch_http import DashboardServer, parse_address
+        try:
+            host, port = parse_address(self.dashboard_address)
+        except ValueError:
+            sys.stderr.write('error: invalid dashboard address "%s"\n' %
+                             self.dashboard_address)
+            return
+        dashboard = DashboardServer(host, port)
+        if dashboard.start():
+            self.dashboard = dashboard
+
     def select_font(self, *args):
         self.fontseldiag.show()
 
@@ -655,14 +1295,22 @@ class Stopwatch:
         self.run_button.turn_on()
 
         if self.mode == self.STOPWATCH:
-            self.stopwatch_start = int(time() - (self.hours[self.mode] * 3600 +
-                                                 self.mins[self.mode] * 60 +
-                                                 self.secs[self.mode]))
+            now = time()
+            self.stopwatch_start = int(now - (self.hours[self.mode] * 3600 +
+                                              self.mins[self.mode] * 60 +
+                                              self.secs[self.mode]))
+            if self.tracked is not None:
+                self.groups.start(self.tracked, now)
+                self.refresh_group(self.tracked)
 
         elif self.mode == self.COUNTDOWN_A:
-            self.countdownA_end = int(time() + (self.hours[self.mode] * 3600 +
-                                                self.mins[self.mode] * 60 +
-                                                self.secs[self.mode]))
+            remaining = (self.hours[self.mode] * 3600 +
+                         self.mins[self.mode] * 60 + self.secs[self.mode])
+            if self.sequence:
+                self.sequence.start(time(), remaining)
+                self.countdownA_end = self.sequence.deadline()
+            else:
+                self.countdownA_end = int(time() + remaining)
 
         else:
             time_array = localtime(time())
@@ -691,11 +1339,19 @@ class Stopwatch:
                 self.timeshift = int(h * 3600 + m * 60 + s)
 
         self.is_running[self.mode] = True
+        self.emit("start")
 
     def stop(self, *args):
+        if self.mode == self.STOPWATCH:
+            self.cancel_trigger()
         self.is_running[self.mode] = False
         self.run_button.turn_off()
 
+        if self.mode == self.STOPWATCH and self.tracked is not None:
+            self.groups.stop(self.tracked)
+            self.refresh_group(self.tracked)
+            self.save_groups()
+
         if self.mode == self.COUNTDOWN_B:
             self.load_values()
         else:
@@ -716,6 +1372,7 @@ class Stopwatch:
 
             self.set_values()
         self.update_display()
+        self.emit("stop")
 
     def toggle(self):
         if self.is_running[self.mode]:
@@ -723,44 +1380,150 @@ class Stopwatch:
         else:
             self.start()
 
-    def run(self):
-        if self.is_running[self.COUNTDOWN_A]:
-            diffA = self.countdownA_end - time()
-            if diffA <= 0:
-                self.set_mode(self.COUNTDOWN_A)
-                self.reset()
-                self.alarm()
+    def get_hms(self, mode, now=None):
+        """Return the (h, m, s) currently shown for the given mode."""
+        if not self.is_running[mode]:
+            return self.hours[mode], self.mins[mode], self.secs[mode]
+        if now is None:
+            now = time()
+        if mode == self.TIME_DISPLAY:
+            time_array = localtime(now + self.timeshift)
+            return time_array[3], time_array[4], time_array[5]
+        if mode == self.STOPWATCH:
+            diff = now - self.stopwatch_start
+        elif mode == self.COUNTDOWN_A:
+            diff = self.countdownA_end - now
+        else:
+            diff = self.countdownB_end - now - self.timeshift
+        (m, s) = divmod(int(diff), 60)
+        (h, m) = divmod(m, 60)
+        return h, m, s
 
+    def get_anchor(self, mode):
+        """Return the time from which a running timer is computed."""
+        if not self.is_running[mode]:
+            return 0.0
+        if mode == self.STOPWATCH:
+            return self.stopwatch_start
+        if mode == self.COUNTDOWN_A:
+            return self.countdownA_end
+        if mode == self.COUNTDOWN_B:
+            return self.countdownB_end
+        return 0.0
+
+    def publish_state(self, state):
+        """Write a get_state() snapshot to the shared state file."""
+        self.state_file.write(
+            self.mode, self.timeshift,
+            [(label, running, hms, self.get_anchor(i))
+             for i, (label, running, hms) in enumerate(state[1:])])
+
+    def get_state(self, now=None):
+        """Return a hashable snapshot of every timer for external viewers."""
+        if now is None:
+            now = time()
+        return (self.mode, ) + tuple(
+            (self.MODE_LABEL[i], self.is_running[i], self.get_hms(i, now))
+            for i in range(self.MODES))
+
+    def collect_due(self, now):
+        """
+        Collect every deadline that has passed, earliest first. Expired modes
+        are stopped here but the display is left for the caller to update.
+        """
+        countdowns = {}
+        if self.is_running[self.COUNTDOWN_A]:
+            countdowns[self.COUNTDOWN_A] = (self.MODE_LABEL[self.COUNTDOWN_A],
+                                            self.countdownA_end, self.sequence)
         if self.is_running[self.COUNTDOWN_B]:
-            diffB = self.countdownB_end - time() - self.timeshift
-            if diffB <= 0:
-                self.set_mode(self.COUNTDOWN_B)
-                self.reset()
-                self.alarm()
+            countdowns[self.COUNTDOWN_B] = (self.MODE_LABEL[self.COUNTDOWN_B],
+                                            self.countdownB_end -
+                                            self.timeshift, None)
+        due, expired = collect_due(now, countdowns, self.scheduler)
+        for mode in expired:
+            self.expire_mode(mode)
+        if (self.sequence and self.is_running[self.COUNTDOWN_A] and
+                latest_mode(due) is not None):
+            # The sequence moved on to its next segment.
+            self.countdownA_end = self.sequence.deadline()
+        return due
+
+    def expire_mode(self, mode):
+        """Stop an expired countdown and restore its initial value."""
+        self.is_running[mode] = False
+        self.hours[mode] = self.mins[mode] = self.secs[mode] = 0
+        self.emit("stop", mode)
+        if mode == self.COUNTDOWN_B:
+            h, m, s = self.get_default_countdown_b()
+        elif self.sequence:
+            self.sequence.reset()
+            h, m, s = self.sequence.remaining_hms()
+        else:
+            h = m = s = 0
+        self.hours[mode] = h
+        self.mins[mode] = m
+        self.secs[mode] = s
+        self.emit("reset", mode)
+
+    def fire_due(self, due, stalled):
+        """Fire the collected deadlines according to the catch-up policy."""
+        alarms, missed = apply_catchup_policy(due, stalled,
+                                              self.catchup_policy)
+        if missed:
+            now = time()
+            lines = []
+            for entry in missed:
+                overrun = now - entry.target
+                lines.append("missed %s by %s" %
+                             (entry.name, format_seconds(overrun)))
+                self.emit("alarm",
+                          entry.mode,
+                          name=entry.name,
+                          target=entry.target,
+                          missed=True,
+                          overrun=overrun)
+            self.show_alarm_window("\n".join(lines))
+        for entry in alarms:
+            self.alarm(entry.alarm_txt,
+                       entry.alarm_cmd,
+                       name=entry.name,
+                       target=entry.target,
+                       mode=entry.mode,
+                       literal=entry.literal)
+
+    def run(self):
+        stalled = self.stall_detector.check()
+        now = time()
+        due = self.collect_due(now)
+        if due:
+            mode = latest_mode(due)
+            if mode is not None:
+                # Switch to the most recently expired mode once for the batch.
+                self.set_mode(mode)
+            self.fire_due(due, stalled)
+            now = time()
+        if self.board is not None:
+            self.board.update(now)
+        if self.groups_view is not None:
+            self.groups_view.update(now)
 
         if self.is_running[self.mode]:
             if not self.run_button.is_on:
                 self.run_button.turn_on()
-            if self.mode == self.TIME_DISPLAY:
-                time_array = localtime(time() + self.timeshift)
-                h = time_array[3]
-                m = time_array[4]
-                s = time_array[5]
-            else:
-                if self.mode == self.STOPWATCH:
-                    diff = time() - self.stopwatch_start
-                else:
-                    if self.mode == self.COUNTDOWN_A:
-                        diff = diffA
-                    else:
-                        diff = diffB
-
-                diff = int(diff)
-                (m, s) = divmod(diff, 60)
-                (h, m) = divmod(m, 60)
-
+            h, m, s = self.get_hms(self.mode, now)
             self.update_display(h=h, m=m, s=s)
 
+        state = self.get_state(now)
+        if state != self.last_state:
+            self.last_state = state
+            if self.dashboard is not None:
+                self.dashboard.publish(state)
+            if self.state_file is not None:
+                self.publish_state(state)
+            self.emit("tick")
+        if self.events is not None:
+            self.events.flush()
+
         return True
 
     def update_display(self, **args):
@@ -782,6 +1545,8 @@ class Stopwatch:
         self.digit_display.set_text("%02d:%02d:%02d" % (h, m, s))
 
     def reset(self, *args):
+        if self.mode == self.STOPWATCH:
+            self.cancel_trigger()
         if self.is_running[self.mode]:
             self.stop()
             self.update_display()
@@ -794,7 +1559,13 @@ class Stopwatch:
             self.is_running[self.mode] = True
         elif self.mode == self.COUNTDOWN_B:
             h, m, s = self.get_default_countdown_b()
+        elif self.mode == self.COUNTDOWN_A and self.sequence:
+            self.sequence.reset()
+            h, m, s = self.sequence.remaining_hms()
         else:
+            if self.mode == self.STOPWATCH and self.laps:
+                self.laps = []
+                self.display_frame.set_label(self.get_mode_label())
             h = 0
             m = 0
             s = 0
@@ -802,6 +1573,151 @@ class Stopwatch:
         self.hour.set_value(h)
         self.min.set_value(m)
         self.sec.set_value(s)
+        self.emit("reset")
+
+    def time_command(self, argv):
+        """Run a command and time it from its launch until it exits."""
+        from gi.repository import GLib
+        try:
+            pid = GLib.spawn_async(argv,
+                                   flags=GLib.SpawnFlags.SEARCH_PATH |
+                                   GLib.SpawnFlags.DO_NOT_REAP_CHILD)[0]
+        except GLib.Error as e:
+            sys.stderr.write("error: unable to run %s: %s\n" %
+                             (argv[0], e.message))
+            return
+        # The child watch is kept after a cancellation to reap the command.
+        trigger = self.start_triggered(monotonic_ns(), " ".join(argv))
+
+        def exited(pid, status, *args):
+            self.stop_triggered(trigger, monotonic_ns())
+            GLib.spawn_close_pid(pid)
+
+        GLib.child_watch_add(GLib.PRIORITY_HIGH, pid, exited)
+
+    def stop_on_exit(self, pid):
+        """Time until process pid exits, which the kernel signals via pidfd."""
+        from gi.repository import GLib
+        try:
+            fd = os.pidfd_open(pid)
+        except AttributeError:
+            sys.stderr.write("error: --stop-on-exit requires pidfd support\n")
+            return
+        except OSError as e:
+            sys.stderr.write("error: unable to watch process %d: %s\n" %
+                             (pid, e))
+            return
+
+        def exited(fd, condition):
+            self.stop_triggered(trigger, monotonic_ns())
+            return False
+
+        def release():
+            GLib.source_remove(source)
+            os.close(fd)
+
+        source = GLib.unix_fd_add_full(GLib.PRIORITY_HIGH, fd,
+                                       GLib.IOCondition.IN, exited)
+        trigger = self.start_triggered(monotonic_ns(), "process %d" % pid,
+                                       release)
+
+    def stop_on_file(self, path):
+        """Time until a file appears, as reported by the file monitor."""
+        from gi.repository import Gio
+        monitor = Gio.File.new_for_path(path).monitor_file(
+            Gio.FileMonitorFlags.WATCH_MOVES, None)
+        # The trigger keeps the monitor referenced until it is cancelled.
+        trigger = self.start_triggered(monotonic_ns(), path, monitor.cancel)
+
+        def changed(monitor, f, other, event):
+            if event in (Gio.FileMonitorEvent.CREATED,
+                         Gio.FileMonitorEvent.MOVED_IN,
+                         Gio.FileMonitorEvent.RENAMED):
+                self.stop_triggered(trigger, monotonic_ns())
+
+        monitor.connect("changed", changed)
+        # Only checked once the monitor is in place so that a file created in
+        # between cannot be missed.
+        if os.path.exists(path):
+            self.stop_triggered(trigger, monotonic_ns())
+
+    def start_triggered(self, start_ns, name, cancel=None):
+        """
+        Start the stopwatch from zero at the given monotonic time and return
+        the Trigger that owns the run.
+        """
+        self.set_mode(self.STOPWATCH)
+        self.reset()
+        self.start()
+        self.trigger = Trigger(name, start_ns, cancel)
+        # Anchor the display on the event rather than on the whole second.
+        self.stopwatch_start = time() - (monotonic_ns() - start_ns) / 1e9
+        return self.trigger
+
+    def cancel_trigger(self):
+        """
+        Detach the trigger from the stopwatch, e.g. when the run is stopped or
+        reset by hand, so that its end is no longer recorded.
+        """
+        if self.trigger is not None:
+            self.trigger.cancel()
+            self.trigger = None
+
+    def stop_triggered(self, trigger, end_ns):
+        """
+        Stop a triggered run and record its exact duration as a lap, unless
+        the trigger no longer owns the run.
+        """
+        if trigger is not self.trigger:
+            return
+        duration_ns = trigger.finish(end_ns)
+        self.trigger = None
+        duration = duration_ns / 1e9
+        self.set_mode(self.STOPWATCH)
+        if self.is_running[self.STOPWATCH]:
+            # stop() takes the stopped value from the display.
+            (m, s) = divmod(duration_ns // 1000000000, 60)
+            (h, m) = divmod(m, 60)
+            self.update_display(h=h, m=m, s=s)
+            self.stop()
+        self.laps.append(duration)
+        self.display_frame.set_label(self.get_mode_label())
+        self.emit("lap",
+                  lap=len(self.laps),
+                  elapsed=duration,
+                  duration_ns=duration_ns,
+                  trigger=trigger.name)
+        sys.stderr.write("%s: %.9fs\n" % (trigger.name, duration))
+
+    def lap(self, *args):
+        if self.mode == self.STOPWATCH and self.is_running[self.mode]:
+            elapsed = time() - self.stopwatch_start
+            self.laps.append(elapsed)
+            self.display_frame.set_label(self.get_mode_label())
+            self.emit("lap", lap=len(self.laps), elapsed=elapsed)
+
+    def emit(self, hook, mode=None, **event):
+        """
+        Pass an event to the plugins and the event stream. The event describes
+        the given mode, by default the current one.
+        """
+        if not self.plugins and self.events is None:
+            return
+        if mode is None:
+            mode = self.mode
+        h, m, s = self.get_hms(mode)
+        event.update(
+            event=hook,
+            mode=mode,
+            label=self.MODE_LABEL[mode],
+            running=self.is_running[mode],
+            time="%02d:%02d:%02d" % (h, m, s),
+            timestamp=time(),
+        )
+        if self.plugins:
+            self.plugins.emit(hook, event)
+        if self.events is not None:
+            self.events.write(hook, event)
 
     def set_values(self):
         self.hour.set_value(self.hours[self.mode])
@@ -835,33 +1751,88 @@ class Stopwatch:
         s = time_array[5]
         return "%02d:%02d:%02d" % (h, m, s)
 
-    def get_alarm_text(self):
-        if self.alarm_txt[:2] == "#!":
-            return subprocess.getoutput(self.alarm_txt[2:])
+    def get_alarm_text(self,
+                       alarm_txt=None,
+                       name=None,
+                       target=None,
+                       literal=False):
+        """
+        Render an alarm text. The target is the real time at which the alarm
+        was due and defaults to now. Literal texts are returned unchanged.
+        """
+        if alarm_txt is None:
+            template = self.alarm_template
         else:
-            return "%%".join([
-                x.replace("%t", self.get_time())
-                for x in self.alarm_txt.split("%%")
-            ])
-
-    def alarm(self):
+            template = compile_alarm_text(alarm_txt, literal)
+        if not template.fields:
+            return template.render({})
+        now = time()
+        if target is None:
+            target = now
+        values = {}
+        for field in template.fields:
+            if field == "t":
+                values[field] = self.get_time()
+            elif field == "n":
+                values[field] = name or self.MODE_LABEL[self.mode]
+            elif field == "m":
+                values[field] = self.MODE_LABEL[self.mode]
+            elif field == "T":
+                values[field] = format_clock(target + self.timeshift)
+            elif field == "o":
+                values[field] = format_seconds(max(0, now - target))
+            elif field == "e":
+                values[field] = "%02d:%02d:%02d" % self.get_hms(self.STOPWATCH)
+            elif field == "l":
+                values[field] = str(len(self.laps))
+        return template.render(values)
+
+    def alarm(self,
+              alarm_txt=None,
+              alarm_cmd=None,
+              name=None,
+              target=None,
+              mode=None,
+              literal=False):
+        """
+        Raise the alarm of a timer. The mode is the countdown that expired, if
+        any, and the target the real time at which it was due.
+        """
         #    self.statusicon.set_blinking(True)
-
-        if len(self.alarm_txt) > 0:
-            self.alarm_win = Gtk.Window(Gtk.WindowType.TOPLEVEL)
-            self.alarm_win.set_position(Gtk.WindowPosition.CENTER)
-            self.alarm_win.set_border_width(15)
-
-            self.alarm_win.label = Gtk.Label(label=self.get_alarm_text())
-            self.alarm_win.label.set_justify(Gtk.Justification.CENTER)
-            self.alarm_win.label.modify_font(self.display_font)
-            self.alarm_win.add(self.alarm_win.label)
-            self.alarm_win.label.show()
-
-            self.alarm_win.show()
-
-        if len(self.alarm_cmd) > 0:
-            os.system(self.alarm_cmd)
+        if alarm_cmd is None:
+            alarm_cmd = self.alarm_cmd
+        if target is None:
+            target = time()
+
+        text = self.alarm_txt if alarm_txt is None else alarm_txt
+        if len(text) > 0:
+            # None is passed on so that the precompiled template is used.
+            self.show_alarm_window(
+                self.get_alarm_text(alarm_txt, name, target, literal))
+
+        self.emit("alarm",
+                  mode,
+                  name=name or self.MODE_LABEL[self.mode if mode is None else
+                                               mode],
+                  target=target,
+                  alarm_txt=text,
+                  alarm_cmd=alarm_cmd)
+
+        if len(alarm_cmd) > 0:
+            os.system(alarm_cmd)
+
+    def show_alarm_window(self, text):
+        self.alarm_win = Gtk.Window(Gtk.WindowType.TOPLEVEL)
+        self.alarm_win.set_position(Gtk.WindowPosition.CENTER)
+        self.alarm_win.set_border_width(15)
+
+        self.alarm_win.label = Gtk.Label(label=text)
+        self.alarm_win.label.set_justify(Gtk.Justification.CENTER)
+        self.alarm_win.label.modify_font(self.display_font)
+        self.alarm_win.add(self.alarm_win.label)
+        self.alarm_win.label.show()
+
+        self.alarm_win.show()
 
     def display_help(self, w):
         help_text = subprocess.getoutput("man pystopwatch")
@@ -891,15 +1862,25 @@ class Stopwatch:
             mode = self.mode
         elif mode != self.mode and 0 <= mode < self.MODES:
             self.mode = mode
+            self.emit("mode_change")
         self.set_values()
-        self.display_frame.set_label(self.MODE_LABEL[self.mode])
+        self.display_frame.set_label(self.get_mode_label())
         self.update_display()
         if self.is_running[self.mode] != self.run_button.is_on:
             self.run_button.toggle()
 
+    def get_mode_label(self):
+        label = self.MODE_LABEL[self.mode]
+        if self.mode == self.STOPWATCH and self.tracked is not None:
+            label += ": " + self.tracked.path()
+        if self.mode == self.STOPWATCH and self.laps:
+            label += " (lap %d)" % len(self.laps)
+        return label
+
     def toggle_mode(self, *args):
         self.mode = (self.mode + 1) % self.MODES
         self.set_mode()
+        self.emit("mode_change")
 
     def show(self, whatever=None):
         if self.colorseldlg is None:
@@ -917,6 +1898,7 @@ class Stopwatch:
             Gdk.KEY_space: self.toggle,
             Gdk.KEY_r: self.reset,
             Gdk.KEY_Tab: self.toggle_mode,
+            Gdk.KEY_l: self.lap,
         }
         # h,H,m,M,s,S to adjust hours, minutes and seconds.
         for field in ("hour", "min", "sec"):
@@ -939,6 +1921,29 @@ class Stopwatch:
         Gtk.main()
 
 
-if __name__ == "__main__":
-    stopwatch = Stopwatch()
+def main(args):
+    options = {}
+    if args.mode is not None:
+        options["mode"] = MODE_NAMES.index(args.mode)
+    if args.start_in_tray:
+        options["start_in_tray"] = True
+    if args.font:
+        options["display_font"] = Pango.FontDescription(args.font)
+    if args.import_files:
+        options["import_files"] = args.import_files
+    if args.emit:
+        options["emit"] = args.emit
+        options["emit_fd"] = args.emit_fd
+        options["emit_ticks"] = args.emit_ticks
+    if args.time:
+        options["time_command"] = args.command
+    if args.stop_on_exit is not None:
+        options["stop_on_exit"] = args.stop_on_exit
+    if args.stop_on_file is not None:
+        options["stop_on_file"] = args.stop_on_file
+    stopwatch = Stopwatch(**options)
     stopwatch.main()
+
+
+if __name__ == "__main__":
+    main(ARGS)
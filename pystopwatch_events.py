@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Copyright (C) 2008-2019  Xyne
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# (version 2) as published by the Free Software Foundation.
+#
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Machine-readable event stream for pyStopwatch.
+
+Events are written as JSON lines or CSV records to a file descriptor that is
+switched to non-blocking mode. Whatever the reader has not consumed yet stays
+in a buffer and is retried on the next write or flush, so a slow reader never
+blocks the GTK main loop. Once the buffer is full, ticks are dropped and
+counted; state changes are always kept.
+
+The non-blocking flag belongs to the open file, which may be shared with
+other processes (e.g. the terminal of the parent shell), so it is restored at
+exit even if the writer is never closed.
+"""
+import atexit
+import csv
+import io
+import json
+import os
+import sys
+
+FORMATS = ("jsonl", "csv")
+CSV_FIELDS = ("timestamp", "event", "mode", "label", "running", "time")
+# Buffered bytes beyond which ticks are dropped.
+MAX_BACKLOG = 64 * 1024
+
+
+class EventWriter:
+    def __init__(self, fd=1, fmt="jsonl", ticks=False):
+        if fmt not in FORMATS:
+            raise ValueError("unknown event format: " + fmt)
+        self.fd = fd
+        self.fmt = fmt
+        self.ticks = ticks
+        self.buffer = bytearray()
+        self.dropped = 0
+        self.closed = False
+        self.blocking = os.get_blocking(fd)
+        os.set_blocking(fd, False)
+        atexit.register(self.restore)
+        if fmt == "csv":
+            self.buffer += self.encode_csv(CSV_FIELDS + ("detail", ))
+
+    def encode_csv(self, row):
+        f = io.StringIO()
+        csv.writer(f, lineterminator="\n").writerow(row)
+        return f.getvalue().encode("utf-8")
+
+    def encode(self, event):
+        if self.fmt == "jsonl":
+            return (json.dumps(event, separators=(",", ":")) + "\n").encode(
+                "utf-8")
+        row = ["%.6f" % event["timestamp"]]
+        row.extend(event[key] for key in CSV_FIELDS[1:])
+        row[4] = int(row[4])
+        detail = " ".join("%s=%s" % (key, value)
+                          for key, value in sorted(event.items())
+                          if key not in CSV_FIELDS)
+        row.append(detail)
+        return self.encode_csv(row)
+
+    def write(self, hook, event):
+        if self.closed:
+            return
+        if hook == "tick":
+            if not self.ticks:
+                return
+            if len(self.buffer) > MAX_BACKLOG:
+                self.dropped += 1
+                return
+        self.buffer += self.encode(event)
+        self.flush()
+
+    def flush(self):
+        while self.buffer and not self.closed:
+            try:
+                n = os.write(self.fd, self.buffer)
+            except BlockingIOError:
+                return
+            except InterruptedError:
+                continue
+            except OSError as e:
+                # The reader went away; there is nobody left to write to.
+                sys.stderr.write("error: event stream closed: %s\n" % e)
+                self.closed = True
+                self.buffer.clear()
+                return
+            del self.buffer[:n]
+
+    def restore(self):
+        """Put the file descriptor back into its original mode."""
+        try:
+            os.set_blocking(self.fd, self.blocking)
+        except OSError:
+            pass
+
+    def close(self):
+        if not self.closed:
+            os.set_blocking(self.fd, True)
+            try:
+                self.flush()
+            finally:
+                self.closed = True
+                self.restore()
+                atexit.unregister(self.restore)
+        if self.dropped:
+            sys.stderr.write("%d tick events were dropped\n" % self.dropped)
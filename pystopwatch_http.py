@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# Copyright (C) 2008-2019  Xyne
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# (version 2) as published by the Free Software Foundation.
+#
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Local HTTP dashboard for pyStopwatch.
+
+The server runs an asyncio loop in a background thread and serves a minimal
+page at "/" plus a Server-Sent Events stream at "/events". The GTK side calls
+publish() with a snapshot on every tick; identical snapshots are dropped, so
+only state changes and second boundaries reach the clients. Each new snapshot
+is encoded once and the same bytes are written to every connected viewer.
+"""
+import asyncio
+import json
+import sys
+import threading
+
+PAGE = b"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>pyStopwatch</title>
+<style>
+body { font-family: sans-serif; background: #111; color: #eee; }
+table { margin: 2em auto; font-size: 3em; border-collapse: collapse; }
+td { padding: 0.2em 0.6em; }
+td.time { font-family: monospace; }
+tr.current { color: #ffc331; }
+tr.stopped { color: #777; }
+</style>
+</head>
+<body>
+<table id="timers"></table>
+<script>
+var table = document.getElementById("timers");
+var source = new EventSource("events");
+source.onmessage = function (event) {
+  var state = JSON.parse(event.data);
+  table.innerHTML = "";
+  state.timers.forEach(function (timer, i) {
+    var row = table.insertRow();
+    row.className = (i == state.mode) ? "current" :
+      (timer.running ? "" : "stopped");
+    row.insertCell().textContent = timer.label;
+    var cell = row.insertCell();
+    cell.className = "time";
+    cell.textContent = timer.time;
+  });
+};
+</script>
+</body>
+</html>
+"""
+
+# Clients whose unsent backlog grows past this are considered dead.
+MAX_CLIENT_BACKLOG = 64 * 1024
+
+
+def parse_address(address, default_port=8080):
+    """Split "host:port" (or just "host") into a (host, port) tuple."""
+    host, sep, port = address.rpartition(":")
+    if not sep:
+        return address, default_port
+    return host.strip("[]") or "127.0.0.1", int(port)
+
+
+def encode_event(state):
+    """Encode a Stopwatch.get_state() snapshot as a single SSE message."""
+    mode = state[0]
+    timers = [{
+        "label": label,
+        "running": running,
+        "time": "%02d:%02d:%02d" % hms,
+    } for label, running, hms in state[1:]]
+    data = json.dumps({"mode": mode, "timers": timers}, separators=(",", ":"))
+    return ("data: %s\n\n" % data).encode("utf-8")
+
+
+class DashboardServer:
+    def __init__(self, host="127.0.0.1", port=8080):
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.clients = set()
+        self.last_state = None
+        self.last_event = None
+        self.ready = threading.Event()
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._serve,
+                                       name="pystopwatch-http",
+                                       daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self.server is not None
+
+    def stop(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def publish(self, state):
+        """Push a new snapshot to all viewers if it differs from the last."""
+        if state == self.last_state:
+            return
+        self.last_state = state
+        if self.server is not None:
+            self.loop.call_soon_threadsafe(self._broadcast,
+                                           encode_event(state))
+
+    def _serve(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            sys.stderr.write("error: unable to start dashboard on %s:%d: %s\n"
+                             % (self.host, self.port, e))
+            self.ready.set()
+            return
+        # Report the real port when an ephemeral one (0) was requested.
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            for writer in self.clients:
+                writer.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+    def _broadcast(self, event):
+        self.last_event = event
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BACKLOG:
+                self.clients.discard(writer)
+                writer.close()
+            else:
+                writer.write(event)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        try:
+            method, path = request.split(b" ", 2)[:2]
+        except ValueError:
+            method = path = b""
+        path = path.split(b"?", 1)[0]
+
+        if method != b"GET":
+            self._respond(writer, b"405 Method Not Allowed", b"text/plain",
+                          b"method not allowed\n")
+        elif path == b"/":
+            self._respond(writer, b"200 OK", b"text/html; charset=utf-8",
+                          PAGE)
+        elif path == b"/events":
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: keep-alive\r\n\r\n")
+            if self.last_event is not None:
+                writer.write(self.last_event)
+            self.clients.add(writer)
+            try:
+                # Viewers never send anything; wait for them to hang up.
+                while await reader.read(1024):
+                    pass
+            except ConnectionError:
+                pass
+            finally:
+                self.clients.discard(writer)
+                writer.close()
+        else:
+            self._respond(writer, b"404 Not Found", b"text/plain",
+                          b"not found\n")
+
+    def _respond(self, writer, status, content_type, body):
+        writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Type: " +
+                     content_type + b"\r\nContent-Length: " +
+                     str(len(body)).encode() +
+                     b"\r\nConnection: close\r\n\r\n" + body)
+        writer.close()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# Copyright (C) 2008-2019  Xyne
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# (version 2) as published by the Free Software Foundation.
+#
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Timer specifications and bulk import for pyStopwatch.
+
+Timers can be imported from CSV files with the columns
+
+    name, time[, alarm text[, alarm command]]
+
+where the time is a duration ("[[H:]M:]S"), a time of day ("@H:M[:S]") or a
+date and time ("YYYY-MM-DD HH:MM[:SS]"), and from iCalendar files, where each
+VEVENT becomes a timer named after its SUMMARY that expires at its DTSTART.
+Calendar files often come from others, so their DESCRIPTION is used as a
+literal alarm text and never as a command or template.
+
+Both formats are read line by line and yield Entry tuples. Entries carry a key
+that identifies them across reloads and the unparsed time, so that a changed
+file can be diffed against the previous import without the relative times
+drifting.
+"""
+import csv
+import os
+from collections import namedtuple
+from datetime import datetime
+from datetime import timezone
+from time import localtime
+from time import time
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
+
+# Literal entries have an alarm text from a third party, which must neither
+# run commands nor expand tokens.
+Entry = namedtuple("Entry",
+                   "key name end alarm_txt alarm_cmd spec literal",
+                   defaults=(False, ))
+
+
+def parse_duration(text):
+    """Convert "[[H:]M:]S" to seconds."""
+    secs = 0
+    for field in text.strip().split(":"):
+        secs = secs * 60 + int(field)
+    return secs
+
+
+def parse_deadline(text, now=None):
+    """
+    Convert a duration ("[[H:]M:]S"), a time of day ("@H:M[:S]") or a date and
+    time ("YYYY-MM-DD HH:MM[:SS]") to an absolute deadline. Times of day refer
+    to their next occurrence.
+    """
+    if now is None:
+        now = time()
+    text = text.strip()
+    if "-" in text[1:]:
+        try:
+            return datetime.fromisoformat(text).timestamp()
+        except ValueError:
+            raise ValueError("invalid date: " + text)
+    if not text.startswith("@"):
+        return now + parse_duration(text)
+    fields = [int(x) for x in text[1:].split(":")]
+    if not 2 <= len(fields) <= 3:
+        raise ValueError("invalid time of day: " + text)
+    fields += [0] * (3 - len(fields))
+    if not (0 <= fields[0] < 24 and 0 <= fields[1] < 60 and
+            0 <= fields[2] < 60):
+        raise ValueError("invalid time of day: " + text)
+    time_array = localtime(now)
+    target = fields[0] * 3600 + fields[1] * 60 + fields[2]
+    current = time_array[3] * 3600 + time_array[4] * 60 + time_array[5]
+    diff = (target - current) % 86400
+    return int(now) + diff
+
+
+def read_csv(f, now=None):
+    if now is None:
+        now = time()
+    seen = {}
+    for lineno, row in enumerate(csv.reader(f), 1):
+        if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+            continue
+        if lineno == 1 and row[0].strip().lower() == "name":
+            continue
+        if len(row) < 2:
+            raise ValueError("line %d: missing time" % lineno)
+        name = row[0].strip()
+        spec = row[1].strip()
+        try:
+            end = parse_deadline(spec, now)
+        except ValueError as e:
+            raise ValueError("line %d: %s" % (lineno, e))
+        alarm_txt = row[2] if len(row) > 2 and row[2] else None
+        alarm_cmd = row[3] if len(row) > 3 and row[3] else None
+        # Repeated names are told apart by their occurrence.
+        n = seen.get(name, 0)
+        seen[name] = n + 1
+        key = name if n == 0 else "%s#%d" % (name, n)
+        yield Entry(key, name, end, alarm_txt, alarm_cmd, spec)
+
+
+def unfold_lines(f):
+    """Join iCalendar continuation lines."""
+    line = None
+    for raw in f:
+        raw = raw.rstrip("\r\n")
+        if raw[:1] in (" ", "\t") and line is not None:
+            line += raw[1:]
+            continue
+        if line is not None:
+            yield line
+        line = raw
+    if line is not None:
+        yield line
+
+
+def unescape_ics(text):
+    return (text.replace("\\n", "\n").replace("\\N", "\n").replace(
+        "\\,", ",").replace("\\;", ";").replace("\\\\", "\\"))
+
+
+def parse_ics_datetime(params, value):
+    value = value.strip()
+    if len(value) == 8 or "VALUE=DATE" in params:
+        return datetime.strptime(value[:8], "%Y%m%d").timestamp()
+    if value.endswith("Z"):
+        return datetime.strptime(value, "%Y%m%dT%H%M%SZ").replace(
+            tzinfo=timezone.utc).timestamp()
+    dt = datetime.strptime(value, "%Y%m%dT%H%M%S")
+    for param in params:
+        if param.startswith("TZID=") and ZoneInfo is not None:
+            try:
+                dt = dt.replace(tzinfo=ZoneInfo(param[5:].strip('"')))
+            except (KeyError, ValueError):
+                pass
+    # Floating times (and unknown zones) are taken as local time.
+    return dt.timestamp()
+
+
+def read_ics(f, now=None):
+    event = None
+    seen = {}
+    # Components nested in the current VEVENT, e.g. VALARM, whose properties
+    # must not override those of the event.
+    depth = 0
+    for line in unfold_lines(f):
+        name, sep, value = line.partition(":")
+        if not sep:
+            continue
+        params = name.split(";")
+        prop = params.pop(0).upper()
+        if event is not None and depth > 0:
+            if prop == "BEGIN":
+                depth += 1
+            elif prop == "END":
+                depth -= 1
+        elif prop == "BEGIN" and value.upper() == "VEVENT":
+            event = {}
+        elif prop == "BEGIN" and event is not None:
+            depth = 1
+        elif prop == "END" and value.upper() == "VEVENT":
+            if event is not None and "DTSTART" in event:
+                summary = unescape_ics(event.get("SUMMARY", ""))
+                spec = event["DTSTART"]
+                try:
+                    end = parse_ics_datetime(*spec)
+                except ValueError:
+                    raise ValueError("invalid DTSTART: " + spec[1])
+                key = event.get("UID") or "%s@%s" % (summary, spec[1])
+                # The overrides of a recurring event share its UID.
+                if "RECURRENCE-ID" in event:
+                    key += "#" + event["RECURRENCE-ID"]
+                n = seen.get(key, 0)
+                seen[key] = n + 1
+                if n:
+                    key = "%s#%d" % (key, n)
+                alarm_txt = event.get("DESCRIPTION")
+                if alarm_txt is not None:
+                    alarm_txt = unescape_ics(alarm_txt)
+                yield Entry(key,
+                            summary,
+                            end,
+                            alarm_txt,
+                            None,
+                            ";".join(spec[0]) + ":" + spec[1],
+                            literal=True)
+            event = None
+        elif event is not None:
+            if prop == "DTSTART":
+                event[prop] = (params, value)
+            elif prop in ("SUMMARY", "UID", "DESCRIPTION", "RECURRENCE-ID"):
+                event[prop] = value
+
+
+def read_timers(path, now=None):
+    """Stream the entries of a CSV or iCalendar file."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if os.path.splitext(path)[1].lower() in (".ics", ".ical", ".ifb"):
+            yield from read_ics(f, now)
+        else:
+            yield from read_csv(f, now)
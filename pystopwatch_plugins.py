@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# Copyright (C) 2008-2019  Xyne
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# (version 2) as published by the Free Software Foundation.
+#
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Plugin support for pyStopwatch.
+
+Plugins are Python files in the "plugins" subdirectory of the configuration
+directory. A plugin hooks into events by defining functions named after them,
+e.g. on_start(event) or on_alarm(event), where event is a dict describing what
+happened. Each plugin gets its own worker thread and bounded queue so that a
+slow plugin never blocks the GTK main loop or the other plugins. Plugins that
+keep exceeding the latency budget are disabled, as are plugins whose current
+call has been running for longer than the budget of all the allowed overruns,
+since a hung handler would otherwise never return to be measured.
+"""
+import importlib.util
+import os
+import queue
+import sys
+import threading
+import traceback
+from time import monotonic
+
+HOOKS = ("start", "stop", "reset", "mode_change", "tick", "lap", "alarm")
+
+
+class Plugin:
+    def __init__(self, name, module, budget, max_overruns, queue_size):
+        self.name = name
+        self.handlers = {}
+        for hook in HOOKS:
+            handler = getattr(module, "on_" + hook, None)
+            if callable(handler):
+                self.handlers[hook] = handler
+        self.budget = budget
+        self.max_overruns = max_overruns
+        self.queue = queue.Queue(queue_size)
+        self.enabled = True
+        # When the handler in progress was called, or None when idle.
+        self.call_started = None
+
+        # statistics
+        self.calls = 0
+        self.errors = 0
+        self.dropped = 0
+        self.overruns = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+        self.thread = threading.Thread(target=self._work,
+                                       name="pystopwatch-plugin-" + name,
+                                       daemon=True)
+        self.thread.start()
+
+    def submit(self, hook, event):
+        if not self.enabled or hook not in self.handlers:
+            return
+        started = self.call_started
+        limit = self.budget * self.max_overruns
+        if started is not None and monotonic() - started > limit:
+            self.enabled = False
+            sys.stderr.write(
+                "error: disabling plugin %s, which has not returned from a "
+                "call within %.3fs\n" % (self.name, limit))
+            return
+        try:
+            self.queue.put_nowait((hook, event))
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        self.enabled = False
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "overruns": self.overruns,
+            "mean_time": self.total_time / self.calls if self.calls else 0.0,
+            "max_time": self.max_time,
+            "enabled": self.enabled,
+        }
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None or not self.enabled:
+                return
+            hook, event = item
+            t0 = self.call_started = monotonic()
+            try:
+                self.handlers[hook](event)
+            except Exception:
+                self.errors += 1
+                sys.stderr.write("error: plugin %s failed in on_%s\n%s" %
+                                 (self.name, hook, traceback.format_exc()))
+            self.call_started = None
+            elapsed = monotonic() - t0
+            self.calls += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            if elapsed > self.budget:
+                self.overruns += 1
+                if self.overruns >= self.max_overruns:
+                    self.enabled = False
+                    sys.stderr.write(
+                        "error: disabling plugin %s after %d calls over the "
+                        "%.3fs latency budget\n" %
+                        (self.name, self.overruns, self.budget))
+                    return
+            else:
+                self.overruns = 0
+
+
+class PluginManager:
+    def __init__(self, budget=0.1, max_overruns=3, queue_size=64):
+        self.budget = budget
+        self.max_overruns = max_overruns
+        self.queue_size = queue_size
+        self.plugins = []
+
+    def load(self, path):
+        """Load a single plugin file. Returns the Plugin or None."""
+        name = os.path.splitext(os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(
+            "pystopwatch_plugin_" + name, path)
+        module = importlib.util.module_from_spec(spec)
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            sys.stderr.write("error: unable to load plugin %s\n%s" %
+                             (path, traceback.format_exc()))
+            return None
+        plugin = Plugin(name, module, self.budget, self.max_overruns,
+                        self.queue_size)
+        self.plugins.append(plugin)
+        return plugin
+
+    def discover(self, plugin_dir):
+        """Load every *.py file in plugin_dir, in alphabetical order."""
+        if not os.path.isdir(plugin_dir):
+            return
+        for fname in sorted(os.listdir(plugin_dir)):
+            if fname.endswith(".py") and not fname.startswith("."):
+                self.load(os.path.join(plugin_dir, fname))
+
+    def emit(self, hook, event):
+        # Each plugin gets its own copy so that none can change what the
+        # others (or the main loop) see.
+        for plugin in self.plugins:
+            plugin.submit(hook, dict(event))
+
+    def stop(self):
+        for plugin in self.plugins:
+            plugin.stop()
+
+    def stats(self):
+        return {plugin.name: plugin.stats() for plugin in self.plugins}
+
+    def report(self, f=None):
+        """Write the timing statistics of every plugin that was called."""
+        if f is None:
+            f = sys.stderr
+        for name, stats in sorted(self.stats().items()):
+            if not stats["calls"] and not stats["dropped"]:
+                continue
+            f.write(
+                "plugin %s: %d calls, mean %.3fms, max %.3fms, %d errors, "
+                "%d dropped%s\n" %
+                (name, stats["calls"], stats["mean_time"] * 1000,
+                 stats["max_time"] * 1000, stats["errors"], stats["dropped"],
+                 "" if stats["enabled"] else ", disabled"))
+
+    def __len__(self):
+        return len(self.plugins)
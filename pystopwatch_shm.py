@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# Copyright (C) 2008-2019  Xyne
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# (version 2) as published by the Free Software Foundation.
+#
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Shared-memory timer state for pyStopwatch.
+
+The running instance publishes its timer table to a small memory-mapped file
+in the runtime directory. The table holds anchors (deadlines, start times and
+the clock shift) rather than rendered values, so it only changes when the
+timers do, and readers compute the current time themselves.
+
+Writes are guarded by a sequence counter: the writer makes it odd before
+changing the table and even afterwards. A reader copies the table and retries
+if the counter was odd or changed in the meantime, which yields a consistent
+snapshot without locks or system calls beyond the initial mmap. A reader
+gives up after MAX_RETRIES attempts, in case the writer died mid-update.
+
+The writer holds an exclusive flock on the file for as long as it runs, so
+a reader that can take the lock knows that the writer is gone and that the
+table is stale, e.g. after a crash.
+
+Without XDG_RUNTIME_DIR the file lives in a directory under /tmp, which other
+users could create first. The directory must therefore be a real directory
+owned by the user and inaccessible to others, and the file is never opened
+through a symbolic link.
+
+Run this module (or "pystopwatch --status") to print the current timer, e.g.
+from a status bar.
+"""
+import fcntl
+import mmap
+import os
+import stat
+import struct
+import sys
+import tempfile
+from time import localtime
+from time import time
+
+MAGIC = b"PSWS"
+LAYOUT = 1
+# magic, layout, sequence, current mode, timer count, timeshift
+HEADER = struct.Struct("<4sIQiid")
+# label, running, stopped h/m/s, anchor
+RECORD = struct.Struct("<32sB3xiiid")
+MAX_TIMERS = 16
+SIZE = HEADER.size + RECORD.size * MAX_TIMERS
+SEQ_OFFSET = 8
+SEQ = struct.Struct("<Q")
+MAX_RETRIES = 10000
+
+TIME_DISPLAY, STOPWATCH, COUNTDOWN_A, COUNTDOWN_B = range(4)
+
+
+def get_runtime_dir(name):
+    fpath = os.getenv("XDG_RUNTIME_DIR")
+    if not fpath:
+        return os.path.join(tempfile.gettempdir(),
+                            "%s-%d" % (name, os.getuid()))
+    return os.path.join(fpath, name)
+
+
+def get_state_path(name="pyStopwatch"):
+    return os.path.join(get_runtime_dir(name), "state")
+
+
+def check_owner(st, path, private=False):
+    """Refuse files that belong to another user or that others can access."""
+    if st.st_uid != os.getuid():
+        raise PermissionError("%s is owned by another user" % path)
+    if private and stat.S_IMODE(st.st_mode) & 0o077:
+        raise PermissionError("%s is accessible to other users" % path)
+
+
+def check_state_dir(path):
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError("%s is not a directory" % path)
+    check_owner(st, path, private=True)
+
+
+def open_state_file(path, flags, mode=0o600):
+    """Open the state file after checking that its directory is safe."""
+    check_state_dir(os.path.dirname(path))
+    fd = os.open(path, flags | os.O_NOFOLLOW, mode)
+    try:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise PermissionError("%s is not a regular file" % path)
+        check_owner(st, path)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+class StateWriter:
+    def __init__(self, path):
+        self.path = path
+        state_dir = os.path.dirname(path)
+        if not os.path.lexists(state_dir):
+            os.makedirs(state_dir, mode=0o700)
+        fd = open_state_file(path, os.O_RDWR | os.O_CREAT)
+        try:
+            # Fails if another instance is already publishing to this file.
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.ftruncate(fd, SIZE)
+            self.map = mmap.mmap(fd, SIZE)
+        except OSError:
+            os.close(fd)
+            raise
+        # Kept open to hold the lock until the writer exits.
+        self.fd = fd
+        self.seq = 0
+        SEQ.pack_into(self.map, SEQ_OFFSET, self.seq)
+
+    def write(self, mode, timeshift, timers):
+        """
+        Publish the timer table. Each timer is a (label, running, (h, m, s),
+        anchor) tuple where the anchor is the stopwatch start time or the
+        countdown deadline.
+        """
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQ_OFFSET, self.seq)
+        HEADER.pack_into(self.map, 0, MAGIC, LAYOUT, self.seq, mode,
+                         len(timers), timeshift)
+        offset = HEADER.size
+        for label, running, (h, m, s), anchor in timers[:MAX_TIMERS]:
+            RECORD.pack_into(self.map, offset, label.encode("utf-8")[:32],
+                             running, h, m, s, anchor)
+            offset += RECORD.size
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQ_OFFSET, self.seq)
+
+    def close(self):
+        self.map.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        os.close(self.fd)
+
+
+class StateReader:
+    def __init__(self, path=None):
+        if path is None:
+            path = get_state_path()
+        self.fd = open_state_file(path, os.O_RDONLY)
+        try:
+            self.map = mmap.mmap(self.fd, SIZE, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            os.close(self.fd)
+            raise OSError("invalid state file: " + path)
+
+    def writer_alive(self):
+        """Return True while the instance that wrote the file is running."""
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return False
+
+    def read(self):
+        """
+        Return (mode, timeshift, timers) from a consistent snapshot, with
+        timers in the format accepted by StateWriter.write.
+        """
+        for _ in range(MAX_RETRIES):
+            seq = SEQ.unpack_from(self.map, SEQ_OFFSET)[0]
+            if seq & 1:
+                continue
+            data = self.map[:]
+            if SEQ.unpack_from(self.map, SEQ_OFFSET)[0] == seq:
+                break
+        else:
+            raise ValueError("the state file is not consistent")
+        magic, layout, _, mode, count, timeshift = HEADER.unpack_from(data)
+        if magic != MAGIC or layout != LAYOUT:
+            raise ValueError("unrecognized state file")
+        timers = []
+        for i in range(min(count, MAX_TIMERS)):
+            label, running, h, m, s, anchor = RECORD.unpack_from(
+                data, HEADER.size + i * RECORD.size)
+            timers.append((label.rstrip(b"\0").decode("utf-8"), bool(running),
+                           (h, m, s), anchor))
+        return mode, timeshift, timers
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+
+def get_hms(mode, timeshift, timer, now=None):
+    """Compute the (h, m, s) shown by a timer, as Stopwatch.get_hms does."""
+    _, running, hms, anchor = timer
+    if not running:
+        return hms
+    if now is None:
+        now = time()
+    if mode == TIME_DISPLAY:
+        time_array = localtime(now + timeshift)
+        return time_array[3], time_array[4], time_array[5]
+    if mode == STOPWATCH:
+        diff = now - anchor
+    elif mode == COUNTDOWN_A:
+        diff = anchor - now
+    else:
+        diff = anchor - now - timeshift
+    (m, s) = divmod(int(diff), 60)
+    (h, m) = divmod(m, 60)
+    return h, m, s
+
+
+def format_state(state, fmt="{label}: {time}", now=None):
+    """
+    Format the current timer. The fields are {label}, {time}, {running} and
+    {state} ("running" or "stopped").
+    """
+    mode, timeshift, timers = state
+    timer = timers[mode]
+    running = timer[1]
+    return fmt.format(
+        label=timer[0],
+        time="%02d:%02d:%02d" % get_hms(mode, timeshift, timer, now),
+        running=int(running),
+        state="running" if running else "stopped",
+    )
+
+
+def main(fmt=None, path=None):
+    try:
+        reader = StateReader(path)
+    except FileNotFoundError:
+        sys.stderr.write("error: pyStopwatch is not running\n")
+        return 1
+    except OSError as e:
+        sys.stderr.write("error: %s\n" % e)
+        return 1
+    try:
+        if not reader.writer_alive():
+            sys.stderr.write("error: pyStopwatch is not running\n")
+            return 1
+        state = reader.read()
+    except ValueError as e:
+        sys.stderr.write("error: %s\n" % e)
+        return 1
+    finally:
+        reader.close()
+    if fmt is None:
+        print(format_state(state))
+    else:
+        print(format_state(state, fmt))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:2]))
@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+# Copyright (C) 2008-2019  Xyne
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# (version 2) as published by the Free Software Foundation.
+#
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Timer data structures for pyStopwatch that do not depend on the GUI.
+"""
+import heapq
+import os
+import re
+import subprocess
+from collections import namedtuple
+from functools import lru_cache
+from itertools import count
+from operator import attrgetter
+from time import monotonic
+from time import time
+
+try:
+    from time import CLOCK_BOOTTIME
+    from time import clock_gettime
+except ImportError:
+    CLOCK_BOOTTIME = None
+    clock_gettime = None
+
+from pystopwatch_import import parse_duration
+
+
+class IntervalSequence:
+    """
+    A chain of countdown segments, e.g. 25/5/25/5 minutes.
+
+    Every deadline is an offset from the absolute start of the sequence, so
+    moving from one segment to the next neither restarts anything nor
+    accumulates drift. Segments are (duration, alarm_txt, alarm_cmd) tuples
+    where None means "use the global setting".
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.ends = []
+        total = 0
+        for duration, _, _ in segments:
+            total += duration
+            self.ends.append(total)
+        self.start_time = None
+        self.index = 0
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        Parse one segment per line: "duration[|alarm text[|alarm command]]".
+        Blank lines and lines beginning with "#" are ignored.
+        """
+        segments = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = [x.strip() for x in line.split("|", 2)]
+            fields += [None] * (3 - len(fields))
+            segments.append((parse_duration(fields[0]), fields[1], fields[2]))
+        return cls(segments)
+
+    def __len__(self):
+        return len(self.segments)
+
+    def start(self, now, remaining):
+        """Run the current segment with the given remaining seconds."""
+        self.start_time = now + remaining - self.ends[self.index]
+
+    def reset(self):
+        self.start_time = None
+        self.index = 0
+
+    def deadline(self):
+        return self.start_time + self.ends[self.index]
+
+    def advance(self, now):
+        """Return the indices of all segments that have expired by now."""
+        expired = []
+        while self.index < len(self.ends) and self.deadline() <= now:
+            expired.append(self.index)
+            self.index += 1
+        return expired
+
+    def finished(self):
+        return self.index >= len(self.ends)
+
+    def remaining_hms(self):
+        """Return the current segment's full duration as (h, m, s)."""
+        (m, s) = divmod(self.segments[self.index][0], 60)
+        (h, m) = divmod(m, 60)
+        return h, m, s
+
+
+class Timer:
+    """A named countdown on the board."""
+
+    __slots__ = ("name", "end", "alarm_txt", "alarm_cmd", "literal",
+                 "expired", "removed", "shown")
+
+    def __init__(self, name, end, alarm_txt=None, alarm_cmd=None,
+                 literal=False):
+        self.name = name
+        self.end = end
+        self.alarm_txt = alarm_txt
+        self.alarm_cmd = alarm_cmd
+        # The alarm text comes from a third party and is shown as is.
+        self.literal = literal
+        self.expired = False
+        self.removed = False
+        # The last second drawn by the board, to skip unchanged rows.
+        self.shown = None
+
+    def remaining(self, now):
+        return self.end - now
+
+
+class Scheduler:
+    """
+    The named timers, with their deadlines in a heap so that each tick only
+    has to look at the earliest one.
+    """
+
+    def __init__(self):
+        self.timers = []
+        self.heap = []
+        self.counter = count()
+
+    def __len__(self):
+        return len(self.timers)
+
+    def add(self, timer):
+        self.timers.append(timer)
+        heapq.heappush(self.heap, (timer.end, next(self.counter), timer))
+
+    def add_many(self, timers):
+        """Add several timers at once with a single heapify."""
+        self.timers.extend(timers)
+        self.heap.extend(
+            (timer.end, next(self.counter), timer) for timer in timers)
+        heapq.heapify(self.heap)
+
+    def remove(self, timer):
+        # Removed timers are skipped lazily when they reach the heap top.
+        timer.removed = True
+        self.timers.remove(timer)
+
+    def remove_many(self, timers):
+        if not timers:
+            return
+        for timer in timers:
+            timer.removed = True
+        self.timers = [timer for timer in self.timers if not timer.removed]
+        # Drop the dead heap entries once they outnumber the live ones.
+        if len(self.heap) > 2 * len(self.timers):
+            self.heap = [x for x in self.heap if not x[2].removed]
+            heapq.heapify(self.heap)
+
+    def expire(self, now):
+        """Return the timers whose deadlines have passed, earliest first."""
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            timer = heapq.heappop(self.heap)[2]
+            if not timer.removed:
+                timer.expired = True
+                expired.append(timer)
+        return expired
+
+
+# What to do with deadlines that passed while suspended or stalled.
+CATCHUP_POLICIES = ("all", "latest", "missed")
+
+# A deadline that has passed. The mode is the expired countdown, or None for
+# timers on the board. Literal alarm texts are not compiled as templates.
+Due = namedtuple("Due", "target mode alarm_txt alarm_cmd name literal",
+                 defaults=(False, ))
+
+
+def boottime():
+    return clock_gettime(CLOCK_BOOTTIME)
+
+
+class StallDetector:
+    """
+    Tell whether the system was suspended or the main loop stalled between
+    two ticks. Suspension shows up as a jump between the boot-time clock,
+    which counts suspended time, and the monotonic clock, which does not.
+    """
+
+    def __init__(self, threshold=2.0, clock=monotonic,
+                 boot_clock=boottime if CLOCK_BOOTTIME else None):
+        self.threshold = threshold
+        self.clock = clock
+        self.boot_clock = boot_clock
+        self.last_tick = None
+        self.last_boot_offset = 0
+
+    def check(self):
+        """Return True if the previous call was too long ago."""
+        mono = self.clock()
+        offset = self.boot_clock() - mono if self.boot_clock else 0
+        stalled = self.last_tick is not None and (
+            mono - self.last_tick > self.threshold or
+            offset - self.last_boot_offset > self.threshold)
+        self.last_tick = mono
+        self.last_boot_offset = offset
+        return stalled
+
+
+def collect_due(now, countdowns, scheduler):
+    """
+    Collect every deadline that has passed, earliest first. countdowns maps
+    each running countdown mode to a (name, deadline, sequence) tuple, where
+    sequence is the IntervalSequence driving it or None.
+
+    Returns the Due records and the modes whose countdown has finished. A
+    sequence is only finished once its last segment has expired.
+    """
+    due = []
+    expired = []
+    for mode, (name, deadline, sequence) in sorted(countdowns.items()):
+        if deadline > now:
+            continue
+        if sequence:
+            for index in sequence.advance(now):
+                _, alarm_txt, alarm_cmd = sequence.segments[index]
+                due.append(
+                    Due(sequence.start_time + sequence.ends[index], mode,
+                        alarm_txt, alarm_cmd, name))
+            if not sequence.finished():
+                continue
+        else:
+            due.append(Due(deadline, mode, None, None, name))
+        expired.append(mode)
+    for timer in scheduler.expire(now):
+        due.append(
+            Due(timer.end, None, timer.alarm_txt, timer.alarm_cmd, timer.name,
+                timer.literal))
+    # Stable, so simultaneous deadlines keep the order above.
+    due.sort(key=attrgetter("target"))
+    return due, expired
+
+
+def latest_mode(due):
+    """The most recently expired mode of a batch, or None."""
+    for entry in reversed(due):
+        if entry.mode is not None:
+            return entry.mode
+    return None
+
+
+def apply_catchup_policy(due, stalled, policy):
+    """
+    Split the deadlines of a batch into (alarms, missed): those whose alarm
+    should go off and those that should only be reported as missed.
+    """
+    if policy not in CATCHUP_POLICIES:
+        raise ValueError("unknown catch-up policy: " + policy)
+    if not stalled or policy == "all":
+        return due, []
+    if policy == "latest":
+        return due[-1:], []
+    return [], due
+
+
+class Trigger:
+    """
+    An external event that started the stopwatch, e.g. a command being
+    launched, and whose end stops it. Times are monotonic nanoseconds.
+
+    The trigger owns the run until it finishes or is cancelled, e.g. because
+    the stopwatch was stopped by hand. Afterwards its end is ignored. The
+    cancel callback releases whatever watches for the end.
+    """
+
+    def __init__(self, name, start_ns, cancel=None):
+        self.name = name
+        self.start_ns = start_ns
+        self.on_cancel = cancel
+        self.active = True
+
+    def cancel(self):
+        if not self.active:
+            return
+        self.active = False
+        if self.on_cancel is not None:
+            self.on_cancel()
+
+    def finish(self, end_ns):
+        """Return the duration in nanoseconds, or None if cancelled."""
+        if not self.active:
+            return None
+        self.cancel()
+        return end_ns - self.start_ns
+
+
+class AlarmTemplate:
+    """
+    An alarm text compiled once into a format string. "%" followed by one of
+    the TOKENS letters is replaced when rendering, "%%" is a literal "%" and
+    anything else is kept as is. Texts beginning with "#!" are commands whose
+    output is displayed instead. Literal texts are displayed unchanged.
+    """
+
+    TOKENS = {
+        "t": "the current time",
+        "n": "the name of the timer",
+        "m": "the label of the current mode",
+        "T": "the target time",
+        "o": "the overrun past the target time",
+        "e": "the elapsed time of the stopwatch",
+        "l": "the number of laps",
+    }
+
+    def __init__(self, text, literal=False):
+        self.command = None
+        self.format = ""
+        fields = []
+        if literal:
+            self.format = text.replace("{", "{{").replace("}", "}}")
+        elif text[:2] == "#!":
+            self.command = text[2:]
+        else:
+            parts = []
+            for i, part in enumerate(re.split(r"%(.)", text, flags=re.S)):
+                if i % 2 == 0:
+                    parts.append(part.replace("{", "{{").replace("}", "}}"))
+                elif part in self.TOKENS:
+                    parts.append("{" + part + "}")
+                    if part not in fields:
+                        fields.append(part)
+                elif part == "%":
+                    parts.append("%")
+                else:
+                    parts.append(("%" + part).replace("{", "{{").replace(
+                        "}", "}}"))
+            self.format = "".join(parts)
+        # The tokens used by the template, so only these need computing.
+        self.fields = tuple(fields)
+
+    def render(self, values):
+        if self.command is not None:
+            return subprocess.getoutput(self.command)
+        return self.format.format_map(values)
+
+
+compile_alarm_text = lru_cache(maxsize=256)(AlarmTemplate)
+
+
+class TimeNode:
+    """
+    A stopwatch in a hierarchy of groups, e.g. client/project/task.
+
+    Every node keeps the total of the finished intervals in its subtree, the
+    number of running nodes below it (itself included) and the sum of their
+    start times. The live subtree total is then
+    total + running * now - anchor_sum, so reading it is O(1) and starting
+    or stopping a node only updates its ancestors.
+    """
+
+    __slots__ = ("name", "parent", "children", "total", "running",
+                 "anchor_sum", "start_time", "shown", "iter")
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        self.total = 0.0
+        self.running = 0
+        self.anchor_sum = 0.0
+        self.start_time = None
+        # The last second drawn by the group view and the node's row.
+        self.shown = None
+        self.iter = None
+
+    def path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return "/".join(reversed(names))
+
+    def elapsed(self, now):
+        return self.total + self.running * now - self.anchor_sum
+
+    def ancestry(self):
+        node = self
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def add_total(self, secs):
+        for node in self.ancestry():
+            node.total += secs
+
+    def start(self, now):
+        if self.start_time is not None:
+            return False
+        self.start_time = now
+        for node in self.ancestry():
+            node.running += 1
+            node.anchor_sum += now
+        return True
+
+    def stop(self, now):
+        if self.start_time is None:
+            return False
+        start = self.start_time
+        self.start_time = None
+        for node in self.ancestry():
+            node.running -= 1
+            node.total += now - start
+            # Avoid accumulating rounding errors in idle subtrees.
+            node.anchor_sum = node.anchor_sum - start if node.running else 0.0
+        return True
+
+
+class TimeTree:
+    def __init__(self):
+        self.root = TimeNode("")
+        self.running = set()
+
+    def get(self, path, create=False):
+        """
+        Look up a "/"-separated path. With create, missing nodes are added
+        and the new nodes are returned as well, outermost first.
+        """
+        node = self.root
+        created = []
+        for name in path.split("/"):
+            name = name.strip()
+            if not name:
+                continue
+            child = node.children.get(name)
+            if child is None:
+                if not create:
+                    return None
+                child = TimeNode(name, node)
+                node.children[name] = child
+                created.append(child)
+            node = child
+        if create:
+            return node, created
+        return node
+
+    def start(self, node, now=None):
+        if node is not self.root and node.start(time() if now is None else now):
+            self.running.add(node)
+
+    def stop(self, node, now=None):
+        if node.stop(time() if now is None else now):
+            self.running.discard(node)
+
+    def walk(self, node=None):
+        """Yield every node below node (default: the root), depth first."""
+        stack = list(reversed(list((node or self.root).children.values())))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(list(node.children.values())))
+
+    def load(self, path):
+        """Load "seconds<TAB>start<TAB>path" lines; start is empty if idle."""
+        if not os.path.exists(path):
+            return
+        with open(path, "r") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t", 2)
+                if len(fields) != 3 or not fields[2]:
+                    continue
+                node = self.get(fields[2], create=True)[0]
+                try:
+                    # Only the node's own time; ancestors get it propagated.
+                    node.add_total(float(fields[0]))
+                    if fields[1]:
+                        self.start(node, float(fields[1]))
+                except ValueError:
+                    continue
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for node in self.walk():
+                own = node.total - sum(x.total for x in node.children.values())
+                start = node.start_time
+                f.write("%f\t%s\t%s\n" % (own, "" if start is None else
+                                            "%f" % start, node.path()))
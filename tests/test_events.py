@@ -0,0 +1,83 @@
+import atexit
+import json
+import os
+
+import pytest
+
+from pystopwatch_events import MAX_BACKLOG, EventWriter
+
+
+def make_event(hook, **extra):
+    event = {
+        "event": hook,
+        "mode": 1,
+        "label": "stopwatch",
+        "running": True,
+        "time": "00:00:01",
+        "timestamp": 1.5,
+    }
+    event.update(extra)
+    return event
+
+
+@pytest.fixture
+def pipe():
+    r, w = os.pipe()
+    yield r, w
+    os.close(r)
+    os.close(w)
+
+
+def test_jsonl(pipe):
+    r, w = pipe
+    writer = EventWriter(w, "jsonl")
+    writer.write("start", make_event("start"))
+    writer.write("tick", make_event("tick"))
+    writer.close()
+    lines = os.read(r, 4096).decode().splitlines()
+    assert [json.loads(line)["event"] for line in lines] == ["start"]
+
+
+def test_csv(pipe):
+    r, w = pipe
+    writer = EventWriter(w, "csv", ticks=True)
+    writer.write("lap", make_event("lap", lap=2))
+    writer.close()
+    assert os.read(r, 4096).decode().splitlines() == [
+        "timestamp,event,mode,label,running,time,detail",
+        "1.500000,lap,1,stopwatch,1,00:00:01,lap=2",
+    ]
+
+
+def test_restores_blocking_mode(pipe):
+    _, w = pipe
+    writer = EventWriter(w)
+    assert not os.get_blocking(w)
+    writer.close()
+    assert os.get_blocking(w)
+
+    os.set_blocking(w, False)
+    writer = EventWriter(w)
+    writer.close()
+    assert not os.get_blocking(w)
+
+
+def test_drops_ticks_under_backpressure(pipe):
+    r, w = pipe
+    writer = EventWriter(w, ticks=True)
+    event = make_event("tick", padding="x" * 1024)
+    while len(writer.buffer) <= MAX_BACKLOG:
+        writer.write("tick", event)
+    writer.write("tick", event)
+    assert writer.dropped == 1
+    # State changes are queued regardless.
+    size = len(writer.buffer)
+    writer.write("stop", make_event("stop"))
+    assert len(writer.buffer) > size
+    writer.restore()
+    atexit.unregister(writer.restore)
+
+
+def test_invalid_fd():
+    with pytest.raises(OSError):
+        EventWriter(99999)
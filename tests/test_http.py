@@ -0,0 +1,119 @@
+import json
+import socket
+import time
+from contextlib import ExitStack
+
+import pytest
+
+from pystopwatch_http import DashboardServer, encode_event, parse_address
+
+STATE = (0, ("Current Time", True, (1, 2, 3)), ("Stopwatch", False, (0, 0, 0)))
+STATE2 = (1, ("Current Time", True, (1, 2, 4)), ("Stopwatch", False, (0, 0, 0)))
+
+
+@pytest.fixture
+def server():
+    server = DashboardServer("127.0.0.1", 0)
+    assert server.start()
+    yield server
+    server.stop()
+
+
+def request(server, path):
+    conn = socket.create_connection(("127.0.0.1", server.port), timeout=2)
+    conn.sendall(b"GET " + path + b" HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    return conn
+
+
+def read_events(conn, count):
+    data = b""
+    while data.count(b"data: ") < count:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return [
+        json.loads(line[6:]) for line in data.split(b"\n")
+        if line.startswith(b"data: ")
+    ]
+
+
+def wait_for_clients(server, count):
+    deadline = time.monotonic() + 2
+    while len(server.clients) != count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(server.clients) == count
+
+
+def test_parse_address():
+    assert parse_address("0.0.0.0:9000") == ("0.0.0.0", 9000)
+    assert parse_address("localhost") == ("localhost", 8080)
+    assert parse_address("[::1]:8000") == ("::1", 8000)
+    with pytest.raises(ValueError):
+        parse_address("host:port")
+
+
+def test_encode_event():
+    event = encode_event(STATE)
+    assert event.startswith(b"data: ") and event.endswith(b"\n\n")
+    data = json.loads(event[6:])
+    assert data["mode"] == 0
+    assert data["timers"][0] == {
+        "label": "Current Time",
+        "running": True,
+        "time": "01:02:03",
+    }
+
+
+def test_page(server):
+    response = b""
+    with request(server, b"/") as conn:
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert b"EventSource" in response
+
+
+def test_not_found(server):
+    with request(server, b"/nothing") as conn:
+        assert conn.recv(65536).startswith(b"HTTP/1.1 404")
+
+
+def test_publish_to_many_clients(server):
+    with ExitStack() as stack:
+        clients = [
+            stack.enter_context(request(server, b"/events"))
+            for _ in range(50)
+        ]
+        wait_for_clients(server, 50)
+        server.publish(STATE)
+        # Identical snapshots are not sent again.
+        server.publish(STATE)
+        server.publish(STATE2)
+        for conn in clients:
+            events = read_events(conn, 2)
+            assert [e["timers"][0]["time"] for e in events] == [
+                "01:02:03", "01:02:04"
+            ]
+    wait_for_clients(server, 0)
+
+
+def test_late_client_gets_last_event(server):
+    server.publish(STATE)
+    with request(server, b"/events") as first:
+        assert read_events(first, 1)[0]["mode"] == 0
+        with request(server, b"/events") as late:
+            assert read_events(late, 1)[0]["mode"] == 0
+
+
+def test_stop_closes_clients():
+    server = DashboardServer("127.0.0.1", 0)
+    assert server.start()
+    with request(server, b"/events") as conn:
+        wait_for_clients(server, 1)
+        server.stop()
+        conn.recv(65536)
+        assert conn.recv(65536) == b""
@@ -0,0 +1,175 @@
+import io
+import time
+
+import pytest
+
+from pystopwatch_import import (parse_deadline, parse_duration, read_csv,
+                                read_ics)
+from pystopwatch_timers import (Scheduler, Timer, collect_due,
+                                compile_alarm_text)
+
+# 2026-10-19 12:00:00 local time
+NOW = time.mktime((2026, 10, 19, 12, 0, 0, 0, 0, -1))
+
+
+def test_parse_duration():
+    assert parse_duration("90") == 90
+    assert parse_duration("25:00") == 1500
+    assert parse_duration(" 1:02:03 ") == 3723
+    with pytest.raises(ValueError):
+        parse_duration("1:xx")
+
+
+def test_parse_deadline_duration():
+    assert parse_deadline("5:00", NOW) == NOW + 300
+
+
+def test_parse_deadline_time_of_day():
+    assert parse_deadline("@12:30", NOW) == NOW + 1800
+    assert parse_deadline("@12:00:30", NOW) == NOW + 30
+    # Times that have passed refer to the next day.
+    assert parse_deadline("@11:00", NOW) == NOW + 23 * 3600
+    assert parse_deadline("@0:00", NOW) == NOW + 12 * 3600
+
+
+@pytest.mark.parametrize("text",
+                         ["@25:00", "@24:00", "@12:75", "@12:00:60", "@-1:00",
+                          "@12", "@1:2:3:4"])
+def test_parse_deadline_out_of_range(text):
+    with pytest.raises(ValueError):
+        parse_deadline(text, NOW)
+
+
+def test_parse_deadline_date():
+    assert parse_deadline("2026-10-19 13:00", NOW) == NOW + 3600
+    with pytest.raises(ValueError):
+        parse_deadline("2026-13-01 10:00", NOW)
+
+
+def test_read_csv():
+    f = io.StringIO("name,time,alarm text,alarm command\n"
+                    "# a comment\n"
+                    "tea,3:00,Tea is ready\n"
+                    "\n"
+                    "tea,@13:00,,notify-send tea\n"
+                    "lunch,2026-10-19 13:00\n")
+    entries = list(read_csv(f, NOW))
+    assert [entry.key for entry in entries] == ["tea", "tea#1", "lunch"]
+    assert entries[0].end == NOW + 180
+    assert entries[0].alarm_txt == "Tea is ready"
+    assert entries[0].alarm_cmd is None
+    assert entries[1].end == NOW + 3600
+    assert entries[1].alarm_txt is None
+    assert entries[1].alarm_cmd == "notify-send tea"
+    assert entries[2].spec == "2026-10-19 13:00"
+
+
+def test_read_csv_reports_line():
+    with pytest.raises(ValueError, match="line 2"):
+        list(read_csv(io.StringIO("tea,3:00\ncoffee,@12:75\n"), NOW))
+    with pytest.raises(ValueError, match="line 1: missing time"):
+        list(read_csv(io.StringIO("tea\n"), NOW))
+
+
+ICS = """BEGIN:VCALENDAR
+VERSION:2.0
+BEGIN:VEVENT
+UID:standup@example.com
+DTSTART:20261019T100000Z
+SUMMARY:Stand-up\\, daily
+DESCRIPTION:Join the
+ call
+BEGIN:VALARM
+ACTION:DISPLAY
+UID:alarm@example.com
+DESCRIPTION:Reminder
+SUMMARY:Alarm summary
+END:VALARM
+END:VEVENT
+BEGIN:VTODO
+SUMMARY:Not an event
+DTSTART:20261019T110000Z
+END:VTODO
+BEGIN:VEVENT
+DTSTART;VALUE=DATE:20261020
+SUMMARY:All day
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+def test_read_ics():
+    entries = list(read_ics(io.StringIO(ICS), NOW))
+    assert len(entries) == 2
+    standup, all_day = entries
+    assert standup.key == "standup@example.com"
+    assert standup.name == "Stand-up, daily"
+    assert standup.alarm_txt == "Join thecall"
+    assert standup.end == 1792404000
+    assert all_day.key == "All day@20261020"
+    assert all_day.end == time.mktime((2026, 10, 20, 0, 0, 0, 0, 0, -1))
+    assert all_day.spec == "VALUE=DATE:20261020"
+
+
+def test_read_ics_ignores_nested_components():
+    f = io.StringIO("BEGIN:VEVENT\n"
+                    "BEGIN:VALARM\n"
+                    "DTSTART:20261019T090000Z\n"
+                    "SUMMARY:Alarm\n"
+                    "END:VALARM\n"
+                    "DTSTART:20261019T100000Z\n"
+                    "SUMMARY:Meeting\n"
+                    "END:VEVENT\n")
+    (entry, ) = read_ics(f, NOW)
+    assert entry.name == "Meeting"
+    assert entry.end == 1792404000
+
+
+def test_read_ics_description_is_literal(tmp_path):
+    marker = tmp_path / "pwned"
+    f = io.StringIO("BEGIN:VEVENT\n"
+                    "DTSTART:20261019T100000Z\n"
+                    "SUMMARY:Invite\n"
+                    "DESCRIPTION:#!touch %s\n"
+                    "END:VEVENT\n" % marker)
+    (entry, ) = read_ics(f, NOW)
+    assert entry.literal
+    timer = Timer(entry.name, entry.end, entry.alarm_txt, entry.alarm_cmd,
+                  entry.literal)
+    scheduler = Scheduler()
+    scheduler.add(timer)
+    (due, ), _ = collect_due(entry.end, {}, scheduler)
+    assert due.literal
+    text = compile_alarm_text(due.alarm_txt, due.literal).render({})
+    assert text == "#!touch %s" % marker
+    assert not marker.exists()
+
+
+def test_read_csv_alarm_text_is_a_template():
+    (entry, ) = read_csv(io.StringIO("tea,3:00,#!date\n"), NOW)
+    assert not entry.literal
+    assert compile_alarm_text(entry.alarm_txt, entry.literal).command == "date"
+
+
+def test_read_ics_recurrence_overrides_have_their_own_key():
+    f = io.StringIO("BEGIN:VEVENT\n"
+                    "UID:weekly@example.com\n"
+                    "DTSTART:20261019T100000Z\n"
+                    "SUMMARY:Weekly\n"
+                    "END:VEVENT\n"
+                    "BEGIN:VEVENT\n"
+                    "UID:weekly@example.com\n"
+                    "RECURRENCE-ID:20261026T100000Z\n"
+                    "DTSTART:20261026T120000Z\n"
+                    "SUMMARY:Weekly (moved)\n"
+                    "END:VEVENT\n"
+                    "BEGIN:VEVENT\n"
+                    "UID:weekly@example.com\n"
+                    "DTSTART:20261102T100000Z\n"
+                    "SUMMARY:Weekly (duplicate)\n"
+                    "END:VEVENT\n")
+    assert [entry.key for entry in read_ics(f, NOW)] == [
+        "weekly@example.com",
+        "weekly@example.com#20261026T100000Z",
+        "weekly@example.com#1",
+    ]
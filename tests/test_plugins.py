@@ -0,0 +1,99 @@
+import io
+import time
+
+from pystopwatch_plugins import PluginManager
+
+
+def write_plugin(tmp_path, name, source):
+    path = tmp_path / (name + ".py")
+    path.write_text(source)
+    return str(path)
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 2
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_discover_and_dispatch(tmp_path):
+    write_plugin(tmp_path, "b", "seen = []\ndef on_start(event): "
+                 "seen.append(event['event'])\n")
+    write_plugin(tmp_path, "a", "def on_stop(event): pass\n")
+    write_plugin(tmp_path, ".hidden", "raise SystemExit\n")
+    manager = PluginManager()
+    manager.discover(str(tmp_path))
+    assert [plugin.name for plugin in manager.plugins] == ["a", "b"]
+    manager.emit("start", {"event": "start"})
+    manager.emit("tick", {"event": "tick"})
+    b = manager.plugins[1]
+    wait_for(lambda: b.calls == 1)
+    assert manager.plugins[0].calls == 0
+    manager.stop()
+
+
+def test_plugins_get_their_own_copy(tmp_path):
+    source = ("events = []\n"
+              "def on_start(event):\n"
+              "    event['changed'] = True\n"
+              "    events.append(event)\n")
+    write_plugin(tmp_path, "a", source)
+    write_plugin(tmp_path, "b", source)
+    manager = PluginManager()
+    manager.discover(str(tmp_path))
+    event = {"event": "start"}
+    manager.emit("start", event)
+    wait_for(lambda: all(plugin.calls == 1 for plugin in manager.plugins))
+    assert event == {"event": "start"}
+    manager.stop()
+
+
+def test_slow_plugin_is_disabled(tmp_path):
+    write_plugin(tmp_path, "slow",
+                 "import time\ndef on_tick(event): time.sleep(0.02)\n")
+    manager = PluginManager(budget=0.005, max_overruns=2)
+    manager.discover(str(tmp_path))
+    plugin = manager.plugins[0]
+    for _ in range(5):
+        manager.emit("tick", {"event": "tick"})
+    wait_for(lambda: not plugin.enabled)
+    assert plugin.calls == 2
+    out = io.StringIO()
+    manager.report(out)
+    assert out.getvalue().startswith("plugin slow: 2 calls")
+    assert out.getvalue().rstrip().endswith("disabled")
+
+
+def test_failing_plugin(tmp_path, capsys):
+    write_plugin(tmp_path, "bad", "def on_alarm(event): 1 / 0\n")
+    write_plugin(tmp_path, "broken", "this is not python\n")
+    manager = PluginManager()
+    manager.discover(str(tmp_path))
+    assert len(manager) == 1
+    manager.emit("alarm", {"event": "alarm"})
+    wait_for(lambda: manager.plugins[0].errors == 1)
+    assert manager.plugins[0].enabled
+    manager.stop()
+
+
+def test_hung_plugin_is_disabled(tmp_path, capsys):
+    write_plugin(tmp_path, "hung",
+                 "import threading\n"
+                 "release = threading.Event()\n"
+                 "def on_alarm(event): release.wait(5)\n")
+    manager = PluginManager(budget=0.05, max_overruns=2)
+    manager.discover(str(tmp_path))
+    plugin = manager.plugins[0]
+    manager.emit("alarm", {"event": "alarm"})
+    wait_for(lambda: plugin.call_started is not None)
+    # Still within the budget of all overruns.
+    manager.emit("alarm", {"event": "alarm"})
+    assert plugin.enabled
+    time.sleep(0.15)
+    manager.emit("alarm", {"event": "alarm"})
+    assert not plugin.enabled
+    assert plugin.calls == 0
+    assert "has not returned" in capsys.readouterr().err
+    plugin.handlers["alarm"].__globals__["release"].set()
+    manager.stop()
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+import pystopwatch_shm
+from pystopwatch_shm import StateReader, StateWriter, format_state, main
+
+TIMERS = [
+    ("Current Time", True, (0, 0, 0), 0.0),
+    ("Stopwatch", True, (0, 0, 0), 1000.0),
+    ("Countdown Timer A", True, (0, 0, 0), 2000.5),
+    ("Countdown Timer B", False, (18, 30, 0), 0.0),
+]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "pyStopwatch" / "state")
+
+
+def test_round_trip(path):
+    writer = StateWriter(path)
+    writer.write(2, 0.0, TIMERS)
+    reader = StateReader(path)
+    assert reader.writer_alive()
+    assert reader.read() == (2, 0.0, TIMERS)
+    writer.write(3, 60.0, TIMERS)
+    assert reader.read()[:2] == (3, 60.0)
+    reader.close()
+    writer.close()
+
+
+def test_format_state(path):
+    assert format_state((1, 0.0, TIMERS), now=1065.0) == "Stopwatch: 00:01:05"
+    assert format_state((2, 0.0, TIMERS), "{time}", now=1000.0) == "00:16:40"
+    assert (format_state((3, 0.0, TIMERS), "{state} {running} {time}") ==
+            "stopped 0 18:30:00")
+
+
+def test_second_writer_is_refused(path):
+    writer = StateWriter(path)
+    with pytest.raises(OSError):
+        StateWriter(path)
+    writer.close()
+
+
+def test_stale_file_is_not_running(path, capsys):
+    writer = StateWriter(path)
+    writer.write(1, 0.0, TIMERS)
+    assert main(path=path) == 0
+    assert capsys.readouterr().out.startswith("Stopwatch: ")
+    # Simulate a crash: the lock goes away but the file stays behind.
+    writer.map.close()
+    pystopwatch_shm.os.close(writer.fd)
+    assert main(path=path) == 1
+    assert "not running" in capsys.readouterr().err
+
+
+def test_missing_file(path):
+    assert main(path=path) == 1
+
+
+def test_torn_write_gives_up(path, monkeypatch):
+    writer = StateWriter(path)
+    writer.write(1, 0.0, TIMERS)
+    # A writer that died between the two sequence updates.
+    pystopwatch_shm.SEQ.pack_into(writer.map, pystopwatch_shm.SEQ_OFFSET, 7)
+    monkeypatch.setattr(pystopwatch_shm, "MAX_RETRIES", 10)
+    reader = StateReader(path)
+    with pytest.raises(ValueError):
+        reader.read()
+    reader.close()
+    writer.close()
+
+
+def test_shared_directory_is_refused(tmp_path):
+    state_dir = tmp_path / "pyStopwatch"
+    state_dir.mkdir(mode=0o755)
+    state_dir.chmod(0o755)
+    with pytest.raises(PermissionError, match="accessible to other users"):
+        StateWriter(str(state_dir / "state"))
+    assert not (state_dir / "state").exists()
+
+
+def test_symlinked_directory_is_refused(tmp_path):
+    target = tmp_path / "elsewhere"
+    target.mkdir(mode=0o700)
+    (tmp_path / "pyStopwatch").symlink_to(target)
+    with pytest.raises(PermissionError, match="not a directory"):
+        StateWriter(str(tmp_path / "pyStopwatch" / "state"))
+
+
+def test_symlinked_state_file_is_refused(path, tmp_path):
+    victim = tmp_path / "bashrc"
+    victim.write_text("keep me\n")
+    os.makedirs(os.path.dirname(path), mode=0o700)
+    os.symlink(str(victim), path)
+    with pytest.raises(OSError):
+        StateWriter(path)
+    with pytest.raises(OSError):
+        StateReader(path)
+    assert victim.read_text() == "keep me\n"
+    assert main(path=path) == 1
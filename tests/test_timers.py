@@ -0,0 +1,294 @@
+import pytest
+
+from pystopwatch_timers import (CATCHUP_POLICIES, AlarmTemplate,
+                                IntervalSequence, Scheduler, StallDetector,
+                                TimeTree, Timer, Trigger, apply_catchup_policy,
+                                collect_due, compile_alarm_text, latest_mode)
+
+
+def test_sequence_from_text():
+    sequence = IntervalSequence.from_text("""
+        # pomodoro
+        25:00|work done
+        5:00|break over|echo bell
+
+        1:00:00
+    """)
+    assert len(sequence) == 3
+    assert sequence.segments == [
+        (1500, "work done", None),
+        (300, "break over", "echo bell"),
+        (3600, None, None),
+    ]
+    assert sequence.ends == [1500, 1800, 5400]
+    assert sequence.remaining_hms() == (0, 25, 0)
+
+
+def test_sequence_invalid_duration():
+    with pytest.raises(ValueError):
+        IntervalSequence.from_text("soon|text")
+
+
+def test_sequence_deadlines_are_absolute():
+    sequence = IntervalSequence([(10, None, None)] * 100)
+    sequence.start(1000.0, 10)
+    # Expiring late does not push the following deadlines back.
+    assert sequence.advance(1010.7) == [0]
+    assert sequence.deadline() == 1020.0
+    assert sequence.advance(1999.0) == list(range(1, 99))
+    assert sequence.deadline() == 2000.0
+    assert not sequence.finished()
+    assert sequence.advance(2000.0) == [99]
+    assert sequence.finished()
+
+
+def test_sequence_resume_and_reset():
+    sequence = IntervalSequence([(60, None, None), (30, None, None)])
+    sequence.start(0.0, 60)
+    assert sequence.advance(60.0) == [0]
+    # Paused with 10 seconds left in the second segment.
+    sequence.start(500.0, 10)
+    assert sequence.deadline() == 510.0
+    sequence.reset()
+    assert sequence.index == 0
+    assert sequence.start_time is None
+
+
+def test_scheduler_expires_in_order():
+    scheduler = Scheduler()
+    timers = [Timer(str(i), 100.0 + i % 7) for i in range(20)]
+    scheduler.add_many(timers)
+    scheduler.add(Timer("late", 101.5))
+    scheduler.remove(timers[0])
+    assert len(scheduler) == 20
+    expired = scheduler.expire(101.5)
+    assert [timer.name for timer in expired] == ["7", "14", "1", "8", "15",
+                                                 "late"]
+    assert all(timer.expired for timer in expired)
+    assert scheduler.expire(101.5) == []
+
+
+def test_scheduler_remove_many_compacts_heap():
+    scheduler = Scheduler()
+    timers = [Timer(str(i), float(i)) for i in range(100)]
+    scheduler.add_many(timers)
+    scheduler.remove_many(timers[:80])
+    assert len(scheduler) == 20
+    assert len(scheduler.heap) == 20
+    assert [timer.name for timer in scheduler.expire(85.0)
+            ] == [str(i) for i in range(80, 86)]
+
+
+def test_timer_remaining():
+    assert Timer("tea", 180.0).remaining(60.0) == 120.0
+
+
+def test_alarm_template_tokens():
+    template = AlarmTemplate("%n is due at %T (%o late), 100%% {done} %x")
+    assert template.fields == ("n", "T", "o")
+    assert template.render({
+        "n": "tea",
+        "T": "12:00:00",
+        "o": "00:00:05"
+    }) == "tea is due at 12:00:00 (00:00:05 late), 100% {done} %x"
+
+
+def test_alarm_template_plain_and_command():
+    assert AlarmTemplate("Time's up!").fields == ()
+    assert AlarmTemplate("Time's up!").render({}) == "Time's up!"
+    template = AlarmTemplate("#!echo %n")
+    assert template.fields == ()
+    assert template.render({}) == "%n"
+
+
+def test_compile_alarm_text_is_cached():
+    assert compile_alarm_text("%t") is compile_alarm_text("%t")
+
+
+def test_time_tree_totals():
+    tree = TimeTree()
+    task, created = tree.get("client/project/task", create=True)
+    assert [node.path() for node in created
+            ] == ["client", "client/project", "client/project/task"]
+    other = tree.get("client/other", create=True)[0]
+    client = tree.get("client")
+    assert tree.get("client/missing") is None
+
+    tree.start(task, 100.0)
+    tree.start(other, 110.0)
+    assert tree.running == {task, other}
+    assert task.elapsed(120.0) == 20.0
+    assert client.elapsed(120.0) == 30.0
+    tree.stop(task, 130.0)
+    assert tree.running == {other}
+    assert client.elapsed(140.0) == 60.0
+    tree.stop(other, 140.0)
+    assert client.running == 0
+    assert client.anchor_sum == 0.0
+    assert tree.root.elapsed(1000.0) == 60.0
+    # Stopping an idle node changes nothing.
+    tree.stop(other, 150.0)
+    assert client.elapsed(150.0) == 60.0
+
+
+def test_time_tree_save_and_load(tmp_path):
+    tree = TimeTree()
+    task = tree.get("client/task", create=True)[0]
+    tree.get("client", create=True)[0].add_total(5.0)
+    tree.start(task, 100.0)
+    tree.stop(task, 110.0)
+    tree.start(task, 200.0)
+    path = str(tmp_path / "groups")
+    tree.save(path)
+
+    loaded = TimeTree()
+    loaded.load(path)
+    assert [node.path() for node in loaded.walk()] == ["client", "client/task"]
+    task = loaded.get("client/task")
+    assert task.start_time == 200.0
+    assert loaded.running == {task}
+    assert loaded.get("client").elapsed(210.0) == 25.0
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_stall_detector_tick_gap():
+    clock = FakeClock(100.0)
+    detector = StallDetector(2.0, clock, None)
+    assert not detector.check()
+    clock.now += 0.5
+    assert not detector.check()
+    # The main loop was blocked, e.g. by an alarm command without "&".
+    clock.now += 30.0
+    assert detector.check()
+    clock.now += 0.5
+    assert not detector.check()
+
+
+def test_stall_detector_suspend():
+    mono = FakeClock(100.0)
+    boot = FakeClock(500.0)
+    detector = StallDetector(2.0, mono, boot)
+    assert not detector.check()
+    # The monotonic clock stops while suspended; the boot-time clock doesn't.
+    mono.now += 0.5
+    boot.now += 3600.5
+    assert detector.check()
+    mono.now += 0.5
+    boot.now += 0.5
+    assert not detector.check()
+
+
+def make_countdowns(now):
+    sequence = IntervalSequence([(10, "work", None), (5, "break", "bell"),
+                                 (10, "done", None)])
+    sequence.start(now, 10)
+    return sequence, {
+        2: ("Countdown Timer A", sequence.deadline(), sequence),
+        3: ("Countdown Timer B", now + 12, None),
+    }
+
+
+def test_collect_due_order():
+    sequence, countdowns = make_countdowns(1000.0)
+    scheduler = Scheduler()
+    scheduler.add_many([Timer("tea", 1011.0, "%n", None),
+                        Timer("later", 2000.0)])
+    due, expired = collect_due(1016.0, countdowns, scheduler)
+    assert [(entry.target, entry.mode, entry.name) for entry in due] == [
+        (1010.0, 2, "Countdown Timer A"),
+        (1011.0, None, "tea"),
+        (1012.0, 3, "Countdown Timer B"),
+        (1015.0, 2, "Countdown Timer A"),
+    ]
+    assert due[0].alarm_txt == "work"
+    assert due[3].alarm_cmd == "bell"
+    # Countdown A still has a segment to go.
+    assert expired == [3]
+    assert sequence.deadline() == 1025.0
+    assert latest_mode(due) == 2
+    assert latest_mode(due[1:2]) is None
+
+
+def test_collect_due_finishes_sequence():
+    sequence, countdowns = make_countdowns(1000.0)
+    due, expired = collect_due(1030.0, countdowns, Scheduler())
+    assert [entry.alarm_txt for entry in due] == ["work", None, "break", "done"]
+    assert expired == [2, 3]
+    assert sequence.finished()
+
+
+def test_collect_due_nothing_due():
+    _, countdowns = make_countdowns(1000.0)
+    assert collect_due(1005.0, countdowns, Scheduler()) == ([], [])
+
+
+def test_catchup_policies():
+    _, countdowns = make_countdowns(1000.0)
+    due = collect_due(1030.0, countdowns, Scheduler())[0]
+    for policy in CATCHUP_POLICIES:
+        assert apply_catchup_policy(due, False, policy) == (due, [])
+    assert apply_catchup_policy(due, True, "all") == (due, [])
+    assert apply_catchup_policy(due, True, "latest") == (due[-1:], [])
+    assert apply_catchup_policy(due, True, "missed") == ([], due)
+    assert apply_catchup_policy([], True, "latest") == ([], [])
+    with pytest.raises(ValueError):
+        apply_catchup_policy(due, True, "some")
+
+
+def test_catchup_after_simulated_suspend():
+    mono = FakeClock(50.0)
+    boot = FakeClock(50.0)
+    detector = StallDetector(2.0, mono, boot)
+    _, countdowns = make_countdowns(1000.0)
+    scheduler = Scheduler()
+    scheduler.add(Timer("tea", 1003.0))
+    assert not detector.check()
+    assert collect_due(1001.0, countdowns, scheduler) == ([], [])
+    # Suspended for an hour: only the boot-time clock moved on.
+    boot.now += 3600.0
+    mono.now += 1.0
+    stalled = detector.check()
+    due = collect_due(4601.0, countdowns, scheduler)[0]
+    alarms, missed = apply_catchup_policy(due, stalled, "latest")
+    assert [entry.target for entry in due] == [
+        1003.0, 1010.0, 1012.0, 1015.0, 1025.0
+    ]
+    assert alarms == due[-1:]
+    assert missed == []
+
+
+def test_alarm_template_literal():
+    template = AlarmTemplate("#!rm -rf ~ %t {x}", literal=True)
+    assert template.command is None
+    assert template.fields == ()
+    assert template.render({}) == "#!rm -rf ~ %t {x}"
+
+
+def test_trigger_finish():
+    released = []
+    trigger = Trigger("make", 1000, lambda: released.append(True))
+    assert trigger.finish(2500000000) == 2499999000
+    assert released == [True]
+    # The end is only recorded once.
+    assert trigger.finish(3000000000) is None
+    trigger.cancel()
+    assert released == [True]
+
+
+def test_trigger_cancelled_by_manual_stop():
+    released = []
+    trigger = Trigger("process 42", 1000, lambda: released.append(True))
+    trigger.cancel()
+    assert released == [True]
+    assert not trigger.active
+    # The process exiting afterwards no longer counts.
+    assert trigger.finish(5000) is None
+    assert released == [True]
+    assert Trigger("path", 0).finish(10) == 10